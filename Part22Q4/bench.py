@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# Мікробенчмарки розв'язувачів з program.py: ns/звернення, звернень/с,
+# пікова пам'ять прогону політики і пам'ять, яку її стан тримає після
+# прогону, для кожної пари (довжина трейсу, розмір кешу). Результати
+# пишуться в JSON; з --baseline порівнюються зі збереженим прогоном (з тим
+# самим навантаженням), і сповільнення понад --tolerance дає код виходу 1.
+
+import gc
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from optparse import OptionParser
+
+import program
+
+QUICK_LENGTHS = [10**4, 10**5, 10**6]
+QUICK_CACHE_SIZES = [10, 1000, 100000]
+FULL_LENGTHS = [10**4, 10**5, 10**6, 10**7, 10**8]
+FULL_CACHE_SIZES = [10, 1000, 100000, 1000000]
+# Навантаження не залежить від сітки розмірів кешу. Zipf на 2e6 сторінках
+# дає помітні влучання на всій сітці (LRU на 1e5 звернень: ~6% при 10
+# кадрах, ~38% при 1000, ~59% при 1e5), тож міряються і влучання, і промахи
+DEFAULT_WORKLOAD = "zipf:n=2000000:alpha=1.0"
+
+def time_policy(policy, cache_size, trace, repeat):
+    # Найкращий з repeat прогонів; збирач сміття вимкнено, щоб не шуміти
+    best = None
+    hit_rate = 0.0
+    for _ in range(repeat):
+        p = program.make_policy(policy, cache_size, seed=0)
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            p.run(trace)
+            elapsed = time.perf_counter() - start
+        finally:
+            gc.enable()
+        if best is None or elapsed < best:
+            best = elapsed
+        hit_rate = p.hit_rate()
+    return best, hit_rate
+
+def trace_peak(trace):
+    # Пік самого читання трейсу (буфери шматків), без жодної політики: ця
+    # частина піку прогону політики від неї не залежить
+    gc.collect()
+    tracemalloc.start()
+    try:
+        for _ in program.iter_chunks(trace):
+            pass
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+def policy_memory(policy, cache_size, trace):
+    # tracemalloc сильно гальмує, тому пам'ять міряється окремим прогоном.
+    # peak - пік прогону разом з тимчасовими структурами (у OPT це next_use
+    # на весь трейс) і буферами шматків; state - що лишилося після прогону
+    gc.collect()
+    tracemalloc.start()
+    try:
+        p = program.make_policy(policy, cache_size, seed=0)
+        tracemalloc.reset_peak()
+        p.run(trace)
+        _, peak = tracemalloc.get_traced_memory()
+        gc.collect()
+        state, _ = tracemalloc.get_traced_memory()
+        del p
+    finally:
+        tracemalloc.stop()
+    return peak, state
+
+def run_benchmarks(policies, lengths, cache_sizes, workload, seed, repeat, mem_limit, workdir):
+    results = []
+    for length in lengths:
+        # Трейс генерується один раз у файл і читається через mmap, як реальні трейси
+        path = os.path.join(workdir, f"trace_{length}.bin")
+        program.write_trace_file(path, program.WorkloadTrace(workload, length, seed=seed))
+        trace = program.TraceFile(path)
+        mem_length = min(length, mem_limit)
+        if mem_length < length:
+            mem_path = os.path.join(workdir, f"trace_{length}_mem.bin")
+            program.write_trace_file(mem_path, program.WorkloadTrace(workload, mem_length, seed=seed))
+            mem_trace = program.TraceFile(mem_path)
+        else:
+            mem_trace = trace
+        base_peak = trace_peak(mem_trace)
+        print(f"len={length:<10} пік читання трейсу (входить у peak): {base_peak / 1024:.1f} KiB")
+
+        for cache_size in cache_sizes:
+            if cache_size > length:
+                continue
+            for policy in policies:
+                seconds, hit_rate = time_policy(policy, cache_size, trace, repeat)
+                peak, state = policy_memory(policy, cache_size, mem_trace)
+                r = {
+                    'policy': policy,
+                    'length': length,
+                    'cache_size': cache_size,
+                    'seconds': seconds,
+                    'ns_per_access': seconds * 1e9 / length,
+                    'accesses_per_sec': length / seconds if seconds > 0 else 0.0,
+                    'peak_bytes': peak,
+                    'trace_peak_bytes': base_peak,
+                    'state_bytes': state,
+                    'mem_accesses': mem_length,
+                    'hit_rate': hit_rate,
+                }
+                results.append(r)
+                print(f"{policy:6} len={length:<10} cache={cache_size:<8} "
+                      f"{r['ns_per_access']:9.1f} ns/access {r['accesses_per_sec']:12.0f} acc/s "
+                      f"peak={peak / 1024:10.1f} KiB state={state / 1024:10.1f} KiB hit={hit_rate:6.2f}%")
+                sys.stdout.flush()
+        os.remove(path)
+        if mem_trace is not trace:
+            os.remove(mem_path)
+    return results
+
+def compare_baseline(results, baseline, tolerance):
+    """Друкує відношення до базового прогону; повертає список сповільнених випадків."""
+    base = {(r['policy'], r['length'], r['cache_size']): r for r in baseline['results']}
+    slower = []
+    print("")
+    print("policy,length,cache_size,ns_per_access,baseline_ns,ratio")
+    for r in results:
+        b = base.get((r['policy'], r['length'], r['cache_size']))
+        if b is None:
+            continue
+        ratio = r['ns_per_access'] / b['ns_per_access'] if b['ns_per_access'] else 0.0
+        mark = " SLOWER" if ratio > 1 + tolerance else ""
+        print(f"{r['policy']},{r['length']},{r['cache_size']},{r['ns_per_access']:.1f},{b['ns_per_access']:.1f},{ratio:.2f}{mark}")
+        if mark:
+            slower.append(r)
+    return slower
+
+def main():
+    parser = OptionParser()
+    parser.add_option("--policies", dest="policies", help="comma-separated policies", default="LRU,RAND,CLOCK", type="string")
+    parser.add_option("--lengths", dest="lengths", help="comma-separated trace lengths", default="", type="string")
+    parser.add_option("--cacheSizes", dest="cacheSizes", help="comma-separated cache sizes", default="", type="string")
+    parser.add_option("--full", dest="full", help="trace lengths 1e4..1e8 and cache sizes 10..1e6", default=False, action="store_true")
+    parser.add_option("-W", "--workload", dest="workload", help="workload model for the traces (see program.parse_workload)", default=DEFAULT_WORKLOAD, type="string")
+    parser.add_option("-s", "--seed", dest="seed", help="trace seed", default=0, type="int")
+    parser.add_option("-r", "--repeat", dest="repeat", help="timed runs per case (best is kept)", default=3, type="int")
+    parser.add_option("--memLimit", dest="memLimit", help="trace length for the tracemalloc pass", default=10**6, type="int")
+    parser.add_option("-o", "--output", dest="output", help="write results as JSON", default="", type="string")
+    parser.add_option("-b", "--baseline", dest="baseline", help="JSON from an earlier run to compare against", default="", type="string")
+    parser.add_option("--tolerance", dest="tolerance", help="allowed slowdown vs baseline (0.1 = 10%)", default=0.1, type="float")
+    (options, args) = parser.parse_args()
+
+    policies = options.policies.split(',')
+    for policy in policies:
+        assert policy in program.POLICIES, f"невідома політика {policy}"
+    if options.lengths:
+        lengths = [int(float(x)) for x in options.lengths.split(',')]
+    else:
+        lengths = FULL_LENGTHS if options.full else QUICK_LENGTHS
+    if options.cacheSizes:
+        cache_sizes = [int(float(x)) for x in options.cacheSizes.split(',')]
+    else:
+        cache_sizes = FULL_CACHE_SIZES if options.full else QUICK_CACHE_SIZES
+    program.parse_workload(options.workload)  # помилка в моделі - до прогонів
+
+    baseline = None
+    if options.baseline:
+        with open(options.baseline) as f:
+            baseline = json.load(f)
+        # Час на звернення порівнянний лише на тому самому трейсі
+        meta = baseline.get('meta', {})
+        for key, value in (('workload', options.workload), ('seed', options.seed)):
+            if meta.get(key) != value:
+                sys.exit(f"Базовий прогін {options.baseline} має {key}={meta.get(key)}, "
+                         f"а цей - {value}; порівняння неможливе")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        results = run_benchmarks(policies, lengths, cache_sizes, options.workload, options.seed,
+                                 options.repeat, options.memLimit, workdir)
+
+    report = {
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'numpy': program.np.__version__ if program.np is not None else None,
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'workload': options.workload,
+            'seed': options.seed,
+            'repeat': options.repeat,
+        },
+        'results': results,
+    }
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(report, f, indent=1)
+        print(f"Результати записано у {options.output}")
+
+    if baseline is not None:
+        slower = compare_baseline(results, baseline, options.tolerance)
+        if slower:
+            print(f"Сповільнення понад {options.tolerance * 100:.0f}%: {len(slower)} випадків")
+            sys.exit(1)
+        print("Сповільнень немає.")
+
+if __name__ == "__main__":
+    main()
@@ -1,124 +1,2306 @@
+import json
+import mmap
+import os
+import pickle
 import random
-from collections import deque
+import struct
+import sys
+import time
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+from heapq import heapify, heappop, heappush
+from multiprocessing import Pool, shared_memory
+from optparse import OptionParser
+from statistics import NormalDist
+
+try:
+    import numpy as np
+except ImportError:
+    # Без NumPy шматки трейсу генеруються звичайним циклом
+    np = None
+
+# Розмір шматка для потокових трейсів (звернень)
+CHUNK_SIZE = 1 << 20
+# Байтів на сторінку в компактних масивах трейсу (формат 'q', int64)
+ITEM_SIZE = 8
 
 # --- 1. Генерація трейсу з локальністю ---
-def generate_locality_trace(max_page, length, hot_ratio=0.2, hot_prob=0.8):
+def generate_locality_trace(max_page, length, hot_ratio=0.2, hot_prob=0.8, seed=None):
     """
-    Генерує трейс, де hot_prob (напр. 80%) звернень йдуть до 
+    Генерує трейс, де hot_prob (напр. 80%) звернень йдуть до
     hot_ratio (напр. 20%) сторінок.
+    Без seed використовує спільний генератор модуля random.
     """
+    rng = random.Random(seed) if seed is not None else random
     trace = []
     hot_boundary = int(max_page * hot_ratio)
-    
+
     for _ in range(length):
-        if random.random() < hot_prob:
+        if rng.random() < hot_prob:
             # Звернення до "гарячої" сторінки
-            page = random.randint(0, hot_boundary)
+            page = rng.randint(0, hot_boundary)
         else:
             # Звернення до "холодної" сторінки
-            page = random.randint(hot_boundary + 1, max_page)
+            page = rng.randint(hot_boundary + 1, max_page)
         trace.append(page)
     return trace
 
+def make_rng(seed):
+    # Генератор для шматків: NumPy, якщо є, інакше random.Random
+    if np is not None:
+        return np.random.default_rng(seed)
+    return random.Random(seed)
+
+def locality_chunk(rng, max_page, size, hot_ratio=0.2, hot_prob=0.8):
+    """
+    Один шматок трейсу з локальністю за один виклик генератора.
+    rng - результат make_rng(); повертає масив NumPy (або список без NumPy).
+    """
+    hot_boundary = int(max_page * hot_ratio)
+    if np is None:
+        return [rng.randint(0, hot_boundary) if rng.random() < hot_prob
+                else rng.randint(hot_boundary + 1, max_page)
+                for _ in range(size)]
+
+    pages = rng.integers(0, hot_boundary + 1, size)
+    cold = rng.random(size) >= hot_prob
+    pages[cold] = rng.integers(hot_boundary + 1, max_page + 1, int(cold.sum()))
+    return pages
+
+def iter_locality_trace(max_page, length, hot_ratio=0.2, hot_prob=0.8, seed=0, chunk_size=CHUNK_SIZE):
+    """
+    Генератор шматків трейсу: у пам'яті одночасно лише chunk_size звернень.
+    Однаковий seed дає однакову послідовність шматків.
+    """
+    rng = make_rng(seed)
+    left = length
+    while left > 0:
+        size = min(chunk_size, left)
+        yield locality_chunk(rng, max_page, size, hot_ratio, hot_prob)
+        left -= size
+
+class LocalityTrace:
+    """
+    Потоковий трейс, який можна проходити багато разів (кожен прохід
+    генерує ті самі шматки з того ж seed). Розв'язувачі приймають його
+    так само, як список.
+    """
+    def __init__(self, max_page, length, hot_ratio=0.2, hot_prob=0.8, seed=0, chunk_size=CHUNK_SIZE):
+        self.max_page = max_page
+        self.length = length
+        self.hot_ratio = hot_ratio
+        self.hot_prob = hot_prob
+        self.seed = seed
+        self.chunk_size = chunk_size
+
+    def __len__(self):
+        return self.length
+
+    def chunks(self):
+        return iter_locality_trace(self.max_page, self.length, self.hot_ratio,
+                                   self.hot_prob, self.seed, self.chunk_size)
+
+# Моделі навантаження. Кожна модель видає шматок сторінок за один виклик
+# (chunk) і пам'ятає свій стан між шматками (позицію циклу, скану, фазу),
+# тож довгий трейс складається з шматків без швів. Моделі комбінуються:
+# MixModel змішує кілька моделей з вагами (кожне звернення - від однієї),
+# PhaseModel перемикає моделі через задану кількість звернень.
+
+def _arange(start, size):
+    if np is not None:
+        return np.arange(start, start + size, dtype=np.int64)
+    return list(range(start, start + size))
+
+def _uniform(rng, low, high, size):
+    # Рівномірно з [low, high)
+    if np is not None:
+        return rng.integers(low, high, size)
+    return [rng.randrange(low, high) for _ in range(size)]
+
+def _positive(kind, **values):
+    for key, value in values.items():
+        if value <= 0:
+            raise ValueError(f"{kind}: {key} має бути додатним (отримано {value})")
+
+def _concat(parts):
+    if np is not None:
+        return np.concatenate(parts) if parts else np.empty(0, dtype=np.int64)
+    return [p for part in parts for p in part]
+
+class UniformModel:
+    """Рівномірно по n сторінках offset..offset+n-1."""
+    def __init__(self, n, offset=0):
+        _positive('uniform', n=n)
+        self.n = n
+        self.offset = offset
+
+    def reset(self):
+        pass
+
+    def chunk(self, rng, size):
+        return _uniform(rng, self.offset, self.offset + self.n, size)
+
+class HotColdModel:
+    """Модель 80/20 з generate_locality_trace: сторінки 0..max_page."""
+    def __init__(self, max_page, hot_ratio=0.2, hot_prob=0.8):
+        self.max_page = max_page
+        self.hot_ratio = hot_ratio
+        self.hot_prob = hot_prob
+
+    def reset(self):
+        pass
+
+    def chunk(self, rng, size):
+        return locality_chunk(rng, self.max_page, size, self.hot_ratio, self.hot_prob)
+
+class ZipfModel:
+    """
+    Zipf(alpha) на n сторінках: сторінка рангу k (від 0) має ймовірність,
+    пропорційну 1 / (k + 1)^alpha. Вибірка - пошук у таблиці CDF.
+    """
+    def __init__(self, n, alpha=1.0, offset=0):
+        _positive('zipf', n=n)
+        self.n = n
+        self.alpha = alpha
+        self.offset = offset
+        if np is not None:
+            weights = np.arange(1, n + 1, dtype=np.float64) ** -alpha
+            self.cdf = np.cumsum(weights)
+            self.cdf /= self.cdf[-1]
+        else:
+            total = 0.0
+            self.cdf = []
+            for k in range(1, n + 1):
+                total += k ** -alpha
+                self.cdf.append(total)
+            self.cdf = [c / total for c in self.cdf]
+
+    def reset(self):
+        pass
+
+    def chunk(self, rng, size):
+        if np is not None:
+            # Відсортовані u роблять пошук у великій таблиці локальним (утричі
+            # швидше); звернення незалежні, тож перемішування після пошуку
+            # повертає той самий розподіл
+            u = rng.random(size)
+            u.sort()
+            ranks = np.searchsorted(self.cdf, u, side='right')
+            rng.shuffle(ranks)
+            return np.minimum(ranks, self.n - 1) + self.offset
+        cdf, last, offset = self.cdf, self.n - 1, self.offset
+        return [min(bisect_right(cdf, rng.random()), last) + offset for _ in range(size)]
+
+class LoopModel:
+    """Циклічний прохід по n сторінках (LRU і CLOCK програють, якщо n > кешу)."""
+    def __init__(self, n, offset=0):
+        _positive('loop', n=n)
+        self.n = n
+        self.offset = offset
+        self.pos = 0
+
+    def reset(self):
+        self.pos = 0
+
+    def chunk(self, rng, size):
+        pages = _arange(self.pos, size)
+        self.pos = (self.pos + size) % self.n
+        if np is not None:
+            return pages % self.n + self.offset
+        return [p % self.n + self.offset for p in pages]
+
+class ScanModel:
+    """Послідовний скан: кожна сторінка - нова, повторних звернень немає."""
+    def __init__(self, offset=10**12):
+        self.offset = offset
+        self.pos = 0
+
+    def reset(self):
+        self.pos = 0
+
+    def chunk(self, rng, size):
+        pages = _arange(self.offset + self.pos, size)
+        self.pos += size
+        return pages
+
+class ShiftModel:
+    """
+    Робочий набір з ws сторінок (рівномірно), що кожні period звернень
+    зсувається на step сторінок.
+    """
+    def __init__(self, ws, period, step=None, offset=0):
+        _positive('shift', ws=ws, period=period)
+        self.ws = ws
+        self.period = period
+        self.step = step if step is not None else ws
+        self.offset = offset
+        self.t = 0
+
+    def reset(self):
+        self.t = 0
+
+    def chunk(self, rng, size):
+        t = self.t
+        self.t += size
+        base = _arange(t, size)
+        if np is not None:
+            base = base // self.period * self.step + self.offset
+            return base + rng.integers(0, self.ws, size)
+        return [b // self.period * self.step + self.offset + rng.randrange(self.ws) for b in base]
+
+class MixModel:
+    """Кожне звернення береться з моделі i з імовірністю weights[i]."""
+    def __init__(self, models, weights):
+        total = float(sum(weights))
+        self.models = models
+        self.cum = []
+        acc = 0.0
+        for w in weights:
+            acc += w / total
+            self.cum.append(acc)
+
+    def reset(self):
+        for m in self.models:
+            m.reset()
+
+    def chunk(self, rng, size):
+        if len(self.models) == 1:
+            return self.models[0].chunk(rng, size)
+        if np is not None:
+            which = np.searchsorted(np.array(self.cum), rng.random(size), side='right')
+            which = np.minimum(which, len(self.models) - 1)
+            out = np.empty(size, dtype=np.int64)
+            for i, m in enumerate(self.models):
+                mask = which == i
+                count = int(mask.sum())
+                if count:
+                    out[mask] = m.chunk(rng, count)
+            return out
+        which = [min(bisect_right(self.cum, rng.random()), len(self.models) - 1) for _ in range(size)]
+        parts = [iter(m.chunk(rng, which.count(i))) for i, m in enumerate(self.models)]
+        return [next(parts[i]) for i in which]
+
+class PhaseModel:
+    """Фази (модель, тривалість) по черзі, по колу."""
+    def __init__(self, phases):
+        self.phases = phases
+        self.index = 0
+        self.left = phases[0][1]
+
+    def reset(self):
+        for m, _ in self.phases:
+            m.reset()
+        self.index = 0
+        self.left = self.phases[0][1]
+
+    def chunk(self, rng, size):
+        parts = []
+        while size > 0:
+            model, length = self.phases[self.index]
+            n = min(size, self.left)
+            parts.append(model.chunk(rng, n))
+            size -= n
+            self.left -= n
+            if self.left == 0:
+                self.index = (self.index + 1) % len(self.phases)
+                self.left = self.phases[self.index][1]
+        return _concat(parts)
+
+# Назва моделі -> (клас, {ключ у рядку: (аргумент конструктора, тип)})
+WORKLOAD_KINDS = {
+    'uniform': (UniformModel, {'n': ('n', int), 'offset': ('offset', int)}),
+    'hotcold': (HotColdModel, {'max': ('max_page', int), 'hot': ('hot_ratio', float), 'prob': ('hot_prob', float)}),
+    'zipf': (ZipfModel, {'n': ('n', int), 'alpha': ('alpha', float), 'offset': ('offset', int)}),
+    'loop': (LoopModel, {'n': ('n', int), 'offset': ('offset', int)}),
+    'scan': (ScanModel, {'offset': ('offset', int)}),
+    'shift': (ShiftModel, {'ws': ('ws', int), 'period': ('period', int), 'step': ('step', int), 'offset': ('offset', int)}),
+}
+
+def parse_workload(spec):
+    """
+    Модель з рядка. Граматика:
+        spec  := phase ('/' phase)*       фази по колу
+        phase := mix ['@' тривалість]     тривалість у зверненнях
+        mix   := comp ('+' comp)*         суміш
+        comp  := kind (':' key=value)*    key w - вага в суміші
+    Напр. "zipf:n=100000:alpha=0.9:w=0.8+scan:w=0.2@500000/loop:n=5000@200000".
+    """
+    phases = []
+    for phase in spec.split('/'):
+        phase, _, length = phase.partition('@')
+        models = []
+        weights = []
+        for comp in phase.split('+'):
+            kind, *params = comp.strip().split(':')
+            if kind not in WORKLOAD_KINDS:
+                raise ValueError(f"невідома модель навантаження {kind!r}")
+            cls, names = WORKLOAD_KINDS[kind]
+            args = {}
+            weight = 1.0
+            for param in params:
+                key, _, value = param.partition('=')
+                if key == 'w':
+                    weight = float(value)
+                elif key in names:
+                    arg, typ = names[key]
+                    args[arg] = typ(float(value))
+                else:
+                    raise ValueError(f"{kind}: невідомий параметр {key!r}")
+            try:
+                models.append(cls(**args))
+            except TypeError:
+                raise ValueError(f"{kind}: бракує параметрів ({', '.join(names)})")
+            weights.append(weight)
+        model = MixModel(models, weights)
+        phases.append((model, int(float(length)) if length else None))
+    if len(phases) == 1 and phases[0][1] is None:
+        return phases[0][0]
+    if any(length is None for _, length in phases):
+        raise ValueError("у кожної з кількох фаз має бути тривалість (@N)")
+    return PhaseModel(phases)
+
+class WorkloadTrace:
+    """
+    Потоковий трейс з моделі навантаження (або рядка для parse_workload).
+    Кожен прохід скидає стан моделі й починає з того ж seed.
+    """
+    def __init__(self, model, length, seed=0, chunk_size=CHUNK_SIZE):
+        self.model = parse_workload(model) if isinstance(model, str) else model
+        self.length = length
+        self.seed = seed
+        self.chunk_size = chunk_size
+
+    def __len__(self):
+        return self.length
+
+    def chunks(self):
+        self.model.reset()
+        rng = make_rng(self.seed)
+        left = self.length
+        while left > 0:
+            size = min(self.chunk_size, left)
+            yield self.model.chunk(rng, size)
+            left -= size
+
+def iter_chunks(trace):
+    """
+    Зводить будь-яку форму трейсу до шматків-списків int: список/кортеж
+    віддається як є, масив NumPy - через tolist(), потоковий трейс -
+    шматок за шматком.
+    """
+    if hasattr(trace, 'chunks'):
+        for chunk in trace.chunks():
+            yield chunk.tolist() if hasattr(chunk, 'tolist') else chunk
+    elif hasattr(trace, 'tolist'):
+        yield trace.tolist()
+    else:
+        yield trace
+
 # --- 2. Алгоритми заміщення ---
+# Кожна політика - об'єкт зі спільним інтерфейсом: run(trace) проганяє
+# послідовність звернень, access(page) - одне звернення, hit_rate() - результат.
+# Вміст кешу індексується словником сторінка -> слот, тому влучання, промах
+# і витіснення коштують O(1), а не O(cache_size), як зі списком.
 
-def solve_lru(trace, cache_size):
-    cache = [] # Використовуємо список як стек: кінець - недавно використані
-    hits = 0
-    for page in trace:
-        if page in cache:
-            hits += 1
-            cache.remove(page) # Переміщуємо в кінець (оновлюємо свіжість)
-            cache.append(page)
+class Policy:
+    name = "?"
+
+    def __init__(self, cache_size):
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def accesses(self):
+        return self.hits + self.misses
+
+    @property
+    def label(self):
+        # Назва для звітів (з параметрами, якщо вони є)
+        return self.name
+
+    def run(self, trace, monitor=None):
+        # trace - список, масив NumPy або потоковий трейс із chunks()
+        if monitor is not None:
+            return monitor.run(self, trace)
+        for chunk in iter_chunks(trace):
+            self._run(chunk)
+        return self
+
+    def _run(self, trace):
+        raise NotImplementedError
+
+    def resident(self):
+        # Кількість сторінок у кеші зараз
+        raise NotImplementedError
+
+    def access(self, page):
+        # Одне звернення; повертає True, якщо це влучання
+        hits = self.hits
+        self._run((page,))
+        return self.hits != hits
+
+    def hit_rate(self):
+        if self.accesses == 0:
+            return 0.0
+        return (self.hits / self.accesses) * 100
+
+class LRUPolicy(Policy):
+    name = "LRU"
+
+    def __init__(self, cache_size):
+        super().__init__(cache_size)
+        # OrderedDict як стек: кінець - недавно використані
+        self.cache = OrderedDict()
+
+    def resident(self):
+        return len(self.cache)
+
+    def _run(self, trace):
+        cache = self.cache
+        touch = cache.move_to_end
+        evict = cache.popitem
+        size = self.cache_size
+        hits = misses = 0
+        for page in trace:
+            if page in cache:
+                hits += 1
+                touch(page) # Переміщуємо в кінець (оновлюємо свіжість)
+            else:
+                misses += 1
+                if len(cache) >= size:
+                    evict(last=False) # Видаляємо найстаріший (початок)
+                cache[page] = None
+        self.hits += hits
+        self.misses += misses
+        return self
+
+class RandPolicy(Policy):
+    name = "RAND"
+
+    def __init__(self, cache_size, rng=None):
+        super().__init__(cache_size)
+        # Без власного генератора використовуємо модуль random (спільний seed)
+        self.rng = rng if rng is not None else random
+        self.slots = []  # слот -> сторінка
+        self.index = {}  # сторінка -> слот
+
+    def resident(self):
+        return len(self.slots)
+
+    def __getstate__(self):
+        # Модуль random не серіалізується - зберігаємо лише його стан
+        state = self.__dict__.copy()
+        if self.rng is random:
+            state['rng'] = None
+            state['module_rng_state'] = random.getstate()
+        return state
+
+    def __setstate__(self, state):
+        module_state = state.pop('module_rng_state', None)
+        self.__dict__.update(state)
+        if self.rng is None:
+            random.setstate(module_state)
+            self.rng = random
+
+    def _run(self, trace):
+        slots = self.slots
+        index = self.index
+        randint = self.rng.randint
+        size = self.cache_size
+        hits = misses = 0
+        for page in trace:
+            if page in index:
+                hits += 1
+            else:
+                misses += 1
+                if len(slots) >= size:
+                    # Жертва - випадковий слот, нова сторінка стає на її місце
+                    evict_idx = randint(0, len(slots) - 1)
+                    del index[slots[evict_idx]]
+                    slots[evict_idx] = page
+                    index[page] = evict_idx
+                else:
+                    index[page] = len(slots)
+                    slots.append(page)
+        self.hits += hits
+        self.misses += misses
+        return self
+
+class SampledLRUPolicy(Policy):
+    """
+    Наближений LRU з вибіркою: при витісненні беремо samples випадкових
+    сторінок з кешу і витісняємо найдавніше використану з них. Замість
+    списку давності - лише мітка часу останнього звернення в кожному слоті.
+    samples >= cache_size дає точний LRU, samples = 1 - RAND.
+    """
+    name = "SLRU"
+
+    def __init__(self, cache_size, samples=5, rng=None):
+        super().__init__(cache_size)
+        self.samples = samples
+        self.rng = rng if rng is not None else random
+        self.slots = []  # слот -> сторінка
+        self.stamp = []  # слот -> момент останнього звернення
+        self.index = {}  # сторінка -> слот
+        self.clock = 0
+
+    def resident(self):
+        return len(self.slots)
+
+    @property
+    def label(self):
+        return f"SLRU-{self.samples}"
+
+    __getstate__ = RandPolicy.__getstate__
+    __setstate__ = RandPolicy.__setstate__
+
+    def _run(self, trace):
+        slots = self.slots
+        stamp = self.stamp
+        index = self.index
+        sample = self.rng.sample
+        size = self.cache_size
+        k = self.samples
+        t = self.clock
+        hits = misses = 0
+        for page in trace:
+            t += 1
+            slot = index.get(page)
+            if slot is not None:
+                hits += 1
+                stamp[slot] = t
+            else:
+                misses += 1
+                if len(slots) >= size:
+                    candidates = sample(range(len(slots)), k) if k < len(slots) else range(len(slots))
+                    victim = min(candidates, key=stamp.__getitem__)
+                    del index[slots[victim]]
+                    slots[victim] = page
+                    stamp[victim] = t
+                    index[page] = victim
+                else:
+                    index[page] = len(slots)
+                    slots.append(page)
+                    stamp.append(t)
+        self.clock = t
+        self.hits += hits
+        self.misses += misses
+        return self
+
+class ClockPolicy(Policy):
+    name = "CLOCK"
+
+    def __init__(self, cache_size, clock_bits=1):
+        super().__init__(cache_size)
+        self.clock_bits = clock_bits
+        self.pages = []  # слот -> сторінка
+        self.bits = []   # слот -> біти використання
+        self.index = {}  # сторінка -> слот
+        self.hand = 0    # Стрілка годинника
+        self.laps = 0    # Повні оберти стрілки (для лічильника її кроків)
+
+    def resident(self):
+        return len(self.pages)
+
+    @property
+    def label(self):
+        return f"CLOCK-{self.clock_bits}"
+
+    @property
+    def hand_advances(self):
+        # Стрілка рухається лише при витісненні, коли кеш уже повний
+        return self.laps * len(self.pages) + self.hand
+
+    def _run(self, trace):
+        pages = self.pages
+        bits = self.bits
+        index = self.index
+        clock_bits = self.clock_bits
+        size = self.cache_size
+        hand = self.hand
+        laps = self.laps
+        hits = misses = 0
+        for page in trace:
+            slot = index.get(page)
+            if slot is not None:
+                # HIT: скидаємо біти використання на максимум
+                hits += 1
+                bits[slot] = clock_bits
+                continue
+
+            # MISS - треба вставити сторінку
+            misses += 1
+            if len(pages) < size:
+                index[page] = len(pages)
+                pages.append(page)
+                bits.append(clock_bits)
+                continue
+
+            # Алгоритм CLOCK: шукаємо жертву
+            while True:
+                # Якщо стрілка вийшла за межі, повертаємо на початок
+                if hand >= len(pages):
+                    hand = 0
+                    laps += 1
+
+                if bits[hand] > 0:
+                    # Даємо другий (або n-й) шанс
+                    bits[hand] -= 1
+                    hand += 1
+                else:
+                    # Знайшли жертву (bits == 0)
+                    del index[pages[hand]]
+                    pages[hand] = page
+                    bits[hand] = clock_bits
+                    index[page] = hand
+                    hand += 1
+                    break
+        self.hand = hand
+        self.laps = laps
+        self.hits += hits
+        self.misses += misses
+        return self
+
+class OPTPolicy(Policy):
+    """
+    Оптимальна політика Беладі (MIN): витісняє сторінку, наступне звернення
+    до якої найдальше в майбутньому. Потребує всього трейсу наперед: run()
+    приймає трейс цілком, а access() і _run() ідуть по трейсу, заданому
+    через prepare() (або конструктор), і перевіряють, що сторінки збігаються.
+    """
+    name = "OPT"
+
+    def __init__(self, cache_size, trace=None):
+        super().__init__(cache_size)
+        self.pages = None
+        if trace is not None:
+            self.prepare(trace)
+
+    def prepare(self, trace):
+        # Трейс у компактний масив int64 (8 байтів на звернення); файл або
+        # спільна пам'ять уже є таким масивом і не копіюються
+        if hasattr(trace, 'pages'):
+            pages = trace.pages()
         else:
-            if len(cache) >= cache_size:
-                cache.pop(0) # Видаляємо найстаріший (початок списку)
-            cache.append(page)
-    return (hits / len(trace)) * 100
+            pages = array('q')
+            for chunk in iter_chunks(trace):
+                pages.extend(chunk)
+        n = len(pages)
 
-def solve_rand(trace, cache_size):
-    cache = []
-    hits = 0
-    for page in trace:
-        if page in cache:
-            hits += 1
+        # Один прохід з кінця: next_use[i] - позиція наступного звернення
+        # до pages[i] (n - більше не буде)
+        next_use = array('q', bytes(n * ITEM_SIZE))
+        last = {}
+        for i in range(n - 1, -1, -1):
+            page = pages[i]
+            next_use[i] = last.get(page, n)
+            last[page] = i
+        del last
+
+        self.pages = pages
+        self.next_use = next_use
+        self.pos = 0
+        # Купа (-наступне_звернення, сторінка); записи, що застаріли після
+        # влучання, відкидаються при витяганні й періодично вичищаються
+        self.cached = {}  # сторінка -> наступне звернення
+        self.heap = []
+        return self
+
+    def run(self, trace, monitor=None):
+        assert monitor is None, "OPT проганяє трейс цілком, без вікон"
+        self.prepare(trace)
+        self._advance(len(self.pages))
+        return self
+
+    def resident(self):
+        return len(self.cached) if self.pages is not None else 0
+
+    def _run(self, trace):
+        # Звернення по одному (access) або шматками: це мають бути
+        # наступні сторінки підготовленого трейсу
+        if self.pages is None:
+            raise ValueError("OPT: спершу prepare(trace) з усім трейсом")
+        pages, pos = self.pages, self.pos
+        if pos + len(trace) > len(pages):
+            raise ValueError("OPT: звернень більше, ніж у підготовленому трейсі")
+        for k, page in enumerate(trace):
+            if pages[pos + k] != page:
+                raise ValueError(f"OPT: звернення {pos + k} до {page}, а в трейсі {pages[pos + k]}")
+        self._advance(len(trace))
+
+    def _advance(self, count):
+        # Наступні count звернень підготовленого трейсу
+        pages, next_use, cached, heap = self.pages, self.next_use, self.cached, self.heap
+        size = self.cache_size
+        limit = 2 * size + 64
+        hits = misses = 0
+        for i in range(self.pos, self.pos + count):
+            page = pages[i]
+            nu = next_use[i]
+            if page in cached:
+                hits += 1
+            else:
+                misses += 1
+                if len(cached) >= size:
+                    while True:
+                        key, victim = heappop(heap)
+                        if cached.get(victim) == -key:
+                            del cached[victim]
+                            break
+            cached[page] = nu
+            heappush(heap, (-nu, page))
+            if len(heap) > limit:
+                heap = [(-v, p) for p, v in cached.items()]
+                heapify(heap)
+        self.heap = heap
+        self.pos += count
+        self.hits += hits
+        self.misses += misses
+
+class ARCPolicy(Policy):
+    """
+    Adaptive Replacement Cache (Megiddo, Modha). T1 - сторінки, до яких
+    звернулися раз, T2 - щонайменше двічі; B1/B2 - "привиди" витіснених з
+    них сторінок. Влучання в привидів зсуває ціль p - частку кешу під T1.
+    """
+    name = "ARC"
+
+    def __init__(self, cache_size):
+        super().__init__(cache_size)
+        self.t1 = OrderedDict()
+        self.t2 = OrderedDict()
+        self.b1 = OrderedDict()
+        self.b2 = OrderedDict()
+        self.p = 0
+
+    def _replace(self, in_b2):
+        # Витісняємо з T1 або T2 залежно від цілі p; жертва стає привидом
+        t1 = self.t1
+        if t1 and (len(t1) > self.p or (in_b2 and len(t1) == self.p)):
+            victim, _ = t1.popitem(last=False)
+            self.b1[victim] = None
         else:
-            if len(cache) >= cache_size:
-                evict_idx = random.randint(0, len(cache) - 1)
-                cache.pop(evict_idx)
-            cache.append(page)
-    return (hits / len(trace)) * 100
-
-def solve_clock(trace, cache_size, clock_bits=1):
-    # cache зберігає [page_id, use_bits]
-    cache = [] 
-    hits = 0
-    hand = 0 # Стрілка годинника
-    
-    for page in trace:
-        # Перевірка на влучання (HIT)
-        found = False
-        for i in range(len(cache)):
-            if cache[i][0] == page:
+            victim, _ = self.t2.popitem(last=False)
+            self.b2[victim] = None
+
+    def resident(self):
+        return len(self.t1) + len(self.t2)
+
+    def _run(self, trace):
+        t1, t2, b1, b2 = self.t1, self.t2, self.b1, self.b2
+        c = self.cache_size
+        hits = misses = 0
+        for page in trace:
+            if page in t2:
                 hits += 1
-                cache[i][1] = clock_bits # Скидаємо біти використання на максимум
-                found = True
-                break
-        
-        if not found:
-            # MISS - треба вставити сторінку
-            if len(cache) < cache_size:
-                cache.append([page, clock_bits])
+                t2.move_to_end(page)
+                continue
+            if page in t1:
+                hits += 1
+                del t1[page]
+                t2[page] = None
+                continue
+
+            misses += 1
+            if page in b1:
+                # Привид з B1: T1 був замалим
+                self.p = min(c, self.p + max(len(b2) / len(b1), 1))
+                self._replace(False)
+                del b1[page]
+                t2[page] = None
+            elif page in b2:
+                # Привид з B2: замалим був T2
+                self.p = max(0, self.p - max(len(b1) / len(b2), 1))
+                self._replace(True)
+                del b2[page]
+                t2[page] = None
             else:
-                # Алгоритм CLOCK: шукаємо жертву
-                while True:
-                    # Якщо стрілка вийшла за межі, повертаємо на початок
-                    if hand >= len(cache):
-                        hand = 0
-                    
-                    if cache[hand][1] > 0:
-                        # Даємо другий (або n-й) шанс
-                        cache[hand][1] -= 1
-                        hand += 1
+                l1 = len(t1) + len(b1)
+                if l1 >= c:
+                    if len(t1) < c:
+                        b1.popitem(last=False)
+                        self._replace(False)
                     else:
-                        # Знайшли жертву (bits == 0)
-                        cache[hand] = [page, clock_bits]
-                        hand += 1
-                        break
-    return (hits / len(trace)) * 100
+                        t1.popitem(last=False)
+                else:
+                    total = l1 + len(t2) + len(b2)
+                    if total >= c:
+                        if total >= 2 * c:
+                            b2.popitem(last=False)
+                        self._replace(False)
+                t1[page] = None
+        self.hits += hits
+        self.misses += misses
+        return self
+
+class TwoQPolicy(Policy):
+    """
+    2Q (Johnson, Shasha): нові сторінки йдуть у FIFO A1in; витіснені з нього
+    запам'ятовуються в привидах A1out. Лише повторне звернення до сторінки з
+    A1out переводить її в основну LRU-чергу Am, тому одноразові скани
+    не витісняють гарячий набір.
+    """
+    name = "2Q"
+
+    def __init__(self, cache_size, kin_ratio=0.25, kout_ratio=0.5):
+        super().__init__(cache_size)
+        self.kin = max(1, int(cache_size * kin_ratio))
+        self.kout = max(1, int(cache_size * kout_ratio))
+        self.a1in = OrderedDict()
+        self.a1out = OrderedDict()
+        self.am = OrderedDict()
+
+    def resident(self):
+        return len(self.a1in) + len(self.am)
+
+    def _run(self, trace):
+        a1in, a1out, am = self.a1in, self.a1out, self.am
+        size, kin, kout = self.cache_size, self.kin, self.kout
+        hits = misses = 0
+        for page in trace:
+            if page in am:
+                hits += 1
+                am.move_to_end(page)
+                continue
+            if page in a1in:
+                # Влучання в A1in не змінює порядок (корельовані звернення)
+                hits += 1
+                continue
+
+            misses += 1
+            if len(a1in) + len(am) >= size:
+                if len(a1in) > kin or not am:
+                    victim, _ = a1in.popitem(last=False)
+                    a1out[victim] = None
+                    if len(a1out) > kout:
+                        a1out.popitem(last=False)
+                else:
+                    am.popitem(last=False)
+            if page in a1out:
+                del a1out[page]
+                am[page] = None
+            else:
+                a1in[page] = None
+        self.hits += hits
+        self.misses += misses
+        return self
+
+class LFUPolicy(Policy):
+    """
+    LFU з O(1) на звернення: сторінки розкладені по кошиках частоти
+    (частота -> OrderedDict у порядку LRU), плюс найменша непорожня частота.
+    Жертва - найстаріша сторінка в кошику min_freq; ні купи, ні сортування.
+    """
+    name = "LFU"
+
+    def __init__(self, cache_size):
+        super().__init__(cache_size)
+        self.freq = {}     # сторінка -> частота
+        self.buckets = {}  # частота -> OrderedDict сторінок
+        self.min_freq = 0
+
+    def resident(self):
+        return len(self.freq)
+
+    def _run(self, trace):
+        freq, buckets = self.freq, self.buckets
+        size = self.cache_size
+        min_freq = self.min_freq
+        hits = misses = 0
+        for page in trace:
+            f = freq.get(page)
+            if f is not None:
+                hits += 1
+                bucket = buckets[f]
+                del bucket[page]
+                if not bucket:
+                    del buckets[f]
+                    if min_freq == f:
+                        min_freq = f + 1
+                f += 1
+                freq[page] = f
+                bucket = buckets.get(f)
+                if bucket is None:
+                    bucket = buckets[f] = OrderedDict()
+                bucket[page] = None
+                continue
+
+            misses += 1
+            if len(freq) >= size:
+                bucket = buckets[min_freq]
+                victim, _ = bucket.popitem(last=False)
+                if not bucket:
+                    del buckets[min_freq]
+                del freq[victim]
+            freq[page] = 1
+            bucket = buckets.get(1)
+            if bucket is None:
+                bucket = buckets[1] = OrderedDict()
+            bucket[page] = None
+            min_freq = 1
+        self.min_freq = min_freq
+        self.hits += hits
+        self.misses += misses
+        return self
+
+class LIRSPolicy(Policy):
+    """
+    LIRS (Jiang, Zhang). Сторінки з малою відстанню між повторними
+    зверненнями (LIR) займають більшу частину кешу; решта (HIR) живе в
+    короткій FIFO-черзі queue. Стек stack впорядковує сторінки за давністю і
+    містить також нерезидентні HIR ("привиди"), щоб помітити їхнє повторне
+    звернення. Привидів не більше ghost_ratio * cache_size.
+    """
+    name = "LIRS"
+
+    def __init__(self, cache_size, hir_ratio=0.01, ghost_ratio=2):
+        super().__init__(cache_size)
+        self.hir_size = max(1, int(cache_size * hir_ratio))
+        self.lir_size = max(0, cache_size - self.hir_size)
+        self.ghost_limit = max(1, int(cache_size * ghost_ratio))
+        self.lir = set()
+        self.stack = OrderedDict()   # кінець - найсвіжіші
+        self.queue = OrderedDict()   # резидентні HIR, початок - наступна жертва
+        self.ghosts = OrderedDict()  # нерезидентні HIR, що ще є в stack
+
+    def resident(self):
+        return len(self.lir) + len(self.queue)
+
+    def _run(self, trace):
+        lir, stack, queue, ghosts = self.lir, self.stack, self.queue, self.ghosts
+        size, lir_size, ghost_limit = self.cache_size, self.lir_size, self.ghost_limit
+        hits = misses = 0
+        for page in trace:
+            if page in lir:
+                hits += 1
+                stack.move_to_end(page)
+            elif page in queue:
+                hits += 1
+                if page in stack:
+                    # Повторне звернення в межах стека: HIR -> LIR
+                    stack.move_to_end(page)
+                    del queue[page]
+                    lir.add(page)
+                else:
+                    stack[page] = None
+                    queue.move_to_end(page)
+            else:
+                misses += 1
+                if len(lir) + len(queue) >= size:
+                    victim, _ = queue.popitem(last=False)
+                    if victim in stack:
+                        ghosts[victim] = None
+                if page in ghosts:
+                    # Привид повернувся, поки ще в стеку: одразу LIR
+                    del ghosts[page]
+                    stack.move_to_end(page)
+                    lir.add(page)
+                elif len(lir) < lir_size:
+                    stack[page] = None
+                    lir.add(page)
+                else:
+                    stack[page] = None
+                    queue[page] = None
+                while len(ghosts) > ghost_limit:
+                    ghost, _ = ghosts.popitem(last=False)
+                    del stack[ghost]
 
-# --- 3. Запуск експерименту ---
+            if len(lir) > lir_size:
+                # Найстаріша LIR-сторінка (дно стека) стає резидентною HIR
+                bottom = next(iter(stack))
+                lir.remove(bottom)
+                del stack[bottom]
+                queue[bottom] = None
+            # Обрізання стека: на дні завжди LIR
+            while stack:
+                bottom = next(iter(stack))
+                if bottom in lir:
+                    break
+                del stack[bottom]
+                if bottom in ghosts:
+                    del ghosts[bottom]
+        self.hits += hits
+        self.misses += misses
+        return self
+
+def solve_lru(trace, cache_size, monitor=None):
+    return LRUPolicy(cache_size).run(trace, monitor).hit_rate()
+
+def solve_rand(trace, cache_size, rng=None, monitor=None):
+    return RandPolicy(cache_size, rng=rng).run(trace, monitor).hit_rate()
+
+def solve_clock(trace, cache_size, clock_bits=1, monitor=None):
+    return ClockPolicy(cache_size, clock_bits=clock_bits).run(trace, monitor).hit_rate()
+
+def solve_slru(trace, cache_size, samples=5, rng=None, monitor=None):
+    return SampledLRUPolicy(cache_size, samples=samples, rng=rng).run(trace, monitor).hit_rate()
+
+def solve_opt(trace, cache_size):
+    return OPTPolicy(cache_size).run(trace).hit_rate()
+
+def solve_arc(trace, cache_size, monitor=None):
+    return ARCPolicy(cache_size).run(trace, monitor).hit_rate()
+
+def solve_2q(trace, cache_size, monitor=None):
+    return TwoQPolicy(cache_size).run(trace, monitor).hit_rate()
+
+def solve_lfu(trace, cache_size, monitor=None):
+    return LFUPolicy(cache_size).run(trace, monitor).hit_rate()
+
+def solve_lirs(trace, cache_size, monitor=None):
+    return LIRSPolicy(cache_size).run(trace, monitor).hit_rate()
+
+SLRU_SAMPLES = 5  # K за замовчуванням, як у Redis
+
+POLICIES = {
+    'LRU': lambda cache_size, clock_bits, seed, samples: LRUPolicy(cache_size),
+    'RAND': lambda cache_size, clock_bits, seed, samples: RandPolicy(cache_size, rng=random.Random(seed)),
+    'CLOCK': lambda cache_size, clock_bits, seed, samples: ClockPolicy(cache_size, clock_bits=clock_bits or 1),
+    'SLRU': lambda cache_size, clock_bits, seed, samples: SampledLRUPolicy(cache_size, samples=samples or SLRU_SAMPLES, rng=random.Random(seed)),
+    'OPT': lambda cache_size, clock_bits, seed, samples: OPTPolicy(cache_size),
+    'ARC': lambda cache_size, clock_bits, seed, samples: ARCPolicy(cache_size),
+    '2Q': lambda cache_size, clock_bits, seed, samples: TwoQPolicy(cache_size),
+    'LFU': lambda cache_size, clock_bits, seed, samples: LFUPolicy(cache_size),
+    'LIRS': lambda cache_size, clock_bits, seed, samples: LIRSPolicy(cache_size),
+}
+
+def make_policy(name, cache_size, clock_bits=None, seed=None, samples=None):
+    """Створює політику за назвою (ключ POLICIES)."""
+    return POLICIES[name](cache_size, clock_bits, seed, samples)
+
+# Покрокові (віконні) лічильники. Політика проганяється вікнами по window
+# звернень; після кожного вікна лічильники беруться з різниці її власних
+# hits/misses/resident(), тож гарячий цикл _run() без монітора не змінюється.
+
+WINDOW_FIELDS = ['policy', 'window', 'start', 'accesses', 'hits', 'misses',
+                 'evictions', 'hit_rate', 'distinct', 'hand_advances',
+                 'advances_per_eviction']
+
+class WindowMonitor:
+    """
+    Пише по рядку на кожне вікно у out (CSV або JSON lines) одразу, як
+    вікно закінчилося. Один монітор можна передавати кільком політикам:
+    рядки розрізняються полем policy. owns: close() закриває й сам out
+    (файл, який відкрив make_monitor), а не лише скидає буфер.
+    """
+    def __init__(self, out, window, fmt='csv', owns=False):
+        assert fmt in ('csv', 'json')
+        self.out = out
+        self.owns = owns
+        self.window = window
+        self.fmt = fmt
+        self.header_done = False
+
+    def close(self):
+        if self.owns:
+            self.out.close()
+        else:
+            self.out.flush()
+
+    def emit(self, row):
+        if self.fmt == 'json':
+            self.out.write(json.dumps(row) + '\n')
+        else:
+            if not self.header_done:
+                self.out.write(','.join(WINDOW_FIELDS) + '\n')
+                self.header_done = True
+            values = []
+            for key in WINDOW_FIELDS:
+                v = row.get(key)
+                if v is None:
+                    values.append('')
+                elif isinstance(v, float):
+                    values.append(f"{v:.4f}")
+                else:
+                    values.append(str(v))
+            self.out.write(','.join(values) + '\n')
+        self.out.flush()
+
+    def run(self, policy, trace, label=None):
+        label = label or policy.label
+        window = self.window
+        index = 0
+        start = policy.accesses
+        hits, misses = policy.hits, policy.misses
+        resident = policy.resident()
+        advances = getattr(policy, 'hand_advances', None)
+        seen = set()
+        filled = 0
+
+        def flush():
+            nonlocal start, hits, misses, resident, advances, seen, filled, index
+            d_hits = policy.hits - hits
+            d_misses = policy.misses - misses
+            now_resident = policy.resident()
+            # Промах, що не збільшив кількість сторінок у кеші, - витіснення
+            evictions = d_misses - (now_resident - resident)
+            row = {
+                'policy': label,
+                'window': index,
+                'start': start,
+                'accesses': filled,
+                'hits': d_hits,
+                'misses': d_misses,
+                'evictions': evictions,
+                'hit_rate': d_hits / filled * 100,
+                'distinct': len(seen),
+            }
+            if advances is not None:
+                now_advances = policy.hand_advances
+                row['hand_advances'] = now_advances - advances
+                row['advances_per_eviction'] = (now_advances - advances) / evictions if evictions else 0.0
+                advances = now_advances
+            self.emit(row)
+            index += 1
+            start += filled
+            hits, misses, resident = policy.hits, policy.misses, now_resident
+            seen = set()
+            filled = 0
+
+        for chunk in iter_chunks(trace):
+            pos = 0
+            while pos < len(chunk):
+                piece = chunk[pos:pos + window - filled]
+                policy._run(piece)
+                seen.update(piece)
+                filled += len(piece)
+                pos += len(piece)
+                if filled == window:
+                    flush()
+        if filled:
+            flush()
+        return policy
+
+# Контрольні точки. Стан політик (вміст кешу, порядок давності, стрілка й
+# біти CLOCK, стан генератора RAND) разом із зміщенням у трейсі періодично
+# зберігається через pickle; після збою прогін продовжується з останньої
+# точки й дає той самий результат, що й безперервний.
+
+CHECKPOINT_VERSION = 1
+
+def save_checkpoint(path, policies, offset, meta):
+    # Запис у тимчасовий файл і атомарна заміна: збій під час запису не
+    # псує попередню точку
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        pickle.dump({'version': CHECKPOINT_VERSION, 'meta': meta, 'offset': offset,
+                     'policies': policies}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+def load_checkpoint(path, meta):
+    """Повертає (policies, offset); meta має збігатися з тим, що збережено."""
+    with open(path, 'rb') as f:
+        state = pickle.load(f)
+    if state.get('version') != CHECKPOINT_VERSION:
+        raise ValueError(f"{path}: інша версія контрольної точки")
+    if state['meta'] != meta:
+        raise ValueError(f"{path}: точка з іншого прогону ({state['meta']} != {meta})")
+    return state['policies'], state['offset']
+
+def iter_chunks_from(trace, offset):
+    # Шматки трейсу, починаючи зі звернення offset. Файл і спільна пам'ять
+    # просто зрізаються; згенерований трейс генерується заново й пропускається
+    if hasattr(trace, 'pages'):
+        pages = trace.pages()
+        step = getattr(trace, 'chunk_size', CHUNK_SIZE)
+        for start in range(offset, len(pages), step):
+            yield pages[start:start + step].tolist()
+        return
+    for chunk in iter_chunks(trace):
+        if offset >= len(chunk):
+            offset -= len(chunk)
+            continue
+        yield chunk[offset:] if offset else chunk
+        offset = 0
+
+def run_with_checkpoints(policies, trace, path, every, meta=None):
+    """
+    Проганяє політики пліч-о-пліч по трейсу і кожні every звернень зберігає
+    їхній стан у path. Якщо path уже існує, policies ігноруються: стан і
+    зміщення беруться з файлу. Повертає політики після всього трейсу.
+    """
+    offset = 0
+    if os.path.exists(path):
+        policies, offset = load_checkpoint(path, meta)
+    since = 0
+    for chunk in iter_chunks_from(trace, offset):
+        pos = 0
+        while pos < len(chunk):
+            piece = chunk[pos:pos + every - since]
+            for p in policies:
+                p._run(piece)
+            pos += len(piece)
+            since += len(piece)
+            offset += len(piece)
+            if since == every:
+                save_checkpoint(path, policies, offset, meta)
+                since = 0
+    save_checkpoint(path, policies, offset, meta)
+    return policies
+
+# --- 3. Крива промахів LRU за один прохід (стекові відстані) ---
+# LRU має властивість включення: вміст кешу розміру c завжди входить у кеш
+# розміру c + 1. Тому звернення є влучанням для всіх розмірів, не менших за
+# його стекову відстань (кількість різних сторінок з попереднього звернення
+# до цієї ж сторінки, включно з нею). Гістограма відстаней дає криву промахів
+# одразу для всіх розмірів кешу.
+
+class StackDistanceTracker:
+    """
+    Стекові відстані LRU за O(log M) на звернення, пам'ять O(M).
+    Дерево Фенвіка над логічним часом: 1 у момент останнього звернення
+    кожної сторінки. Кількість одиниць після моменту prev - це кількість
+    різних сторінок, до яких зверталися після prev.
+    """
+    def __init__(self):
+        self.last = {}  # сторінка -> момент останнього звернення
+        self.cap = 1024
+        self.tree = [0] * (self.cap + 1)
+        self.now = 0
+
+    def __len__(self):
+        return len(self.last)
+
+    def _compact(self):
+        # Час закінчився - перенумеровуємо живі позначки 0..M-1 і
+        # залишаємо щонайменше M вільних моментів (амортизовано O(log M))
+        last = self.last
+        order = sorted(last, key=last.__getitem__)
+        for t, p in enumerate(order):
+            last[p] = t
+        now = self.now = len(order)
+        cap = self.cap = max(1024, 2 * now)
+        tree = self.tree = [0] + [1] * now + [0] * (cap - now)
+        for i in range(1, cap + 1):
+            j = i + (i & -i)
+            if j <= cap:
+                tree[j] += tree[i]
+
+    def _unmark(self, prev):
+        tree, cap = self.tree, self.cap
+        i = prev + 1
+        while i <= cap:
+            tree[i] -= 1
+            i += i & -i
+
+    def access(self, page):
+        """Повертає стекову відстань звернення (0 - перше звернення до сторінки)."""
+        if self.now == self.cap:
+            self._compact()
+        tree, cap, last = self.tree, self.cap, self.last
+
+        dist = 0
+        prev = last.get(page)
+        if prev is not None:
+            # Відстань = позначки в (prev, now) + 1 = len(last) - prefix(prev) + 1
+            i = prev + 1
+            before = 0
+            while i > 0:
+                before += tree[i]
+                i -= i & -i
+            dist = len(last) - before + 1
+            self._unmark(prev)
+
+        now = self.now
+        last[page] = now
+        i = now + 1
+        while i <= cap:
+            tree[i] += 1
+            i += i & -i
+        self.now = now + 1
+        return dist
+
+    def forget(self, page):
+        """Прибирає сторінку, ніби до неї ніколи не зверталися."""
+        prev = self.last.pop(page, None)
+        if prev is not None:
+            self._unmark(prev)
+
+def stack_distance_histogram(trace):
+    """
+    Повертає (hist, cold, total): hist[d] - кількість звернень зі стековою
+    відстанню d, cold - перші звернення до сторінок (обов'язкові промахи),
+    total - кількість звернень. Час O(N log M), пам'ять O(M), де M - кількість
+    різних сторінок.
+    """
+    access = StackDistanceTracker().access
+    hist = [0]
+    cold = total = 0
+    for chunk in iter_chunks(trace):
+        total += len(chunk)
+        for page in chunk:
+            dist = access(page)
+            if dist == 0:
+                cold += 1
+                continue
+            if dist >= len(hist):
+                hist.extend([0] * (dist - len(hist) + 1))
+            hist[dist] += 1
+    return hist, cold, total
+
+def lru_mrc(trace):
+    """
+    Крива влучань LRU: rates[c] - hit rate (%) для кешу з c кадрів,
+    c = 0..M. Для c > M значення таке саме, як для M.
+    """
+    hist, cold, total = stack_distance_histogram(trace)
+    rates = [0.0]
+    hits = 0
+    for d in range(1, len(hist)):
+        hits += hist[d]
+        rates.append((hits / total) * 100 if total else 0.0)
+    return rates
+
+# Наближена крива з просторовою вибіркою (SHARDS, Waldspurger et al.).
+# Сторінка потрапляє у вибірку, якщо її хеш менший за поріг T, тобто з
+# імовірністю R = T / SHARDS_MODULUS - завжди разом з усіма своїми
+# зверненнями. Стекові відстані у вибірці масштабуються на 1/R.
+# З max_pages поріг знижується щоразу, коли вибірка перевищує бюджет
+# (витісняються сторінки з найбільшим хешем), тому пам'ять стала.
+
+SHARDS_MODULUS = 1 << 24
+SHARDS_HASH_MULT = 0x9E3779B97F4A7C15  # мультиплікативний хеш (Фібоначчі)
+MASK64 = (1 << 64) - 1
+
+def shards_hash(page):
+    # 64-бітний добуток; старші 24 біти - хеш для порогу
+    return (page * SHARDS_HASH_MULT) & MASK64
+
+class _ShardsSample:
+    """
+    Гістограма масштабованих відстаней для однієї (під)вибірки.
+    share - частка загальної вибірки (1 або 1/groups). Зниження порогу
+    множить усі накопичені ваги на f; щоб не проходити гістограму щоразу,
+    зберігаємо ваги в одиницях unit (справжня вага = збережена * unit).
+    """
+    def __init__(self, share):
+        self.share = share
+        self.tracker = StackDistanceTracker()
+        self.hist = {}  # масштабована відстань -> збережена вага
+        self.sampled = 0.0  # збережена вага всіх вибраних звернень
+        self.unit = 1.0
+
+    def add(self, page, rate):
+        dist = self.tracker.access(page)
+        w = 1.0 / self.unit
+        self.sampled += w
+        if dist:
+            key = int(dist / (rate * self.share) + 0.5)
+            self.hist[key] = self.hist.get(key, 0.0) + w
+        return dist
+
+    def rescale(self, f):
+        self.unit *= f
+
+    def hit_rates(self, sizes, rate, total):
+        r = rate * self.share
+        if total == 0 or r == 0:
+            return [0.0] * len(sizes)
+        # SHARDS_adj: розбіжність між очікуваною (total * r) і фактичною
+        # кількістю вибраних звернень відноситься до найменшої відстані
+        hits = total * r - self.sampled * self.unit
+        keys = sorted(self.hist)
+        rates = []
+        k = 0
+        for c in sizes:
+            while k < len(keys) and keys[k] <= c:
+                hits += self.hist[keys[k]] * self.unit
+                k += 1
+            rates.append(min(100.0, max(0.0, hits / r / total * 100)))
+        return rates
+
+def shards_mrc(trace, rate=0.01, max_pages=0, groups=8, sizes=None, points=100):
+    """
+    Наближена крива влучань LRU. Повертає (sizes, rates, errors, info):
+    rates[i] - оцінка hit rate (%) для кешу sizes[i], errors[i] - її
+    стандартна похибка (%). Похибка оцінюється розкидом між groups
+    незалежними підвибірками (за іншими бітами того ж хешу).
+    info - словник: total, rate (кінцева частота вибірки), pages (у вибірці).
+    max_pages > 0 вмикає режим фіксованої пам'яті.
+    """
+    threshold = max(1, int(rate * SHARDS_MODULUS))
+    main = _ShardsSample(1.0)
+    subs = [_ShardsSample(1.0 / groups) for _ in range(groups)]
+    heap = []  # (-хеш, сторінка) для сторінок у вибірці
+    total = 0
+    max_dist = 0
+
+    for chunk in (trace.chunks() if hasattr(trace, 'chunks') else (trace,)):
+        total += len(chunk)
+        # Попередній відбір за поточним порогом; поріг може знизитися
+        # всередині шматка, тому нижче перевіряємо ще раз
+        if np is not None:
+            arr = np.asarray(chunk, dtype=np.int64)
+            prod = arr.view(np.uint64) * np.uint64(SHARDS_HASH_MULT)
+            sel = (prod >> np.uint64(40)) < np.uint64(threshold)
+            pages = arr[sel].tolist()
+            prods = prod[sel].tolist()
+        else:
+            pages = []
+            prods = []
+            for page in (chunk.tolist() if hasattr(chunk, 'tolist') else chunk):
+                prod = shards_hash(page)
+                if (prod >> 40) < threshold:
+                    pages.append(page)
+                    prods.append(prod)
+
+        for page, prod in zip(pages, prods):
+            h = prod >> 40
+            if h >= threshold:
+                continue
+            r = threshold / SHARDS_MODULUS
+            dist = main.add(page, r)
+            subs[(prod >> 20) % groups].add(page, r)
+            if dist == 0:
+                heappush(heap, (-h, page))
+            elif dist / r > max_dist:
+                max_dist = dist / r
+            if max_pages and len(main.tracker) > max_pages:
+                # Бюджет вичерпано: новий поріг - найбільший хеш у вибірці
+                new_threshold = -heap[0][0]
+                while heap and -heap[0][0] >= new_threshold:
+                    _, victim = heappop(heap)
+                    main.tracker.forget(victim)
+                    subs[(shards_hash(victim) >> 20) % groups].tracker.forget(victim)
+                f = new_threshold / threshold
+                main.rescale(f)
+                for sub in subs:
+                    sub.rescale(f)
+                threshold = new_threshold
+
+    r = threshold / SHARDS_MODULUS
+    if sizes is None:
+        top = max(1, int(max_dist + 0.5))
+        step = max(1, top // points)
+        sizes = list(range(step, top + step, step))
+    rates = main.hit_rates(sizes, r, total)
+    per_group = [sub.hit_rates(sizes, r, total) for sub in subs]
+    errors = []
+    for i in range(len(sizes)):
+        values = [g[i] for g in per_group]
+        mean = sum(values) / groups
+        var = sum((v - mean) ** 2 for v in values) / max(1, groups - 1)
+        errors.append((var / groups) ** 0.5)
+    info = {'total': total, 'rate': r, 'pages': len(main.tracker)}
+    return sizes, rates, errors, info
+
+# --- 4. Паралельний перебір параметрів ---
+# Трейс для кожного seed генерується один раз у спільну пам'ять (int64).
+# Процеси пулу підключаються до неї за іменем і читають шматками без копії
+# всього трейсу; кожна конфігурація (політика, кеш, біти, seed) - окрема задача.
+
+class SharedTrace:
+    """Трейс у блоці спільної пам'яті; читається шматками, як LocalityTrace."""
+    def __init__(self, shm, length, chunk_size=CHUNK_SIZE):
+        self.shm = shm
+        self.length = length
+        self.chunk_size = chunk_size
+
+    def __len__(self):
+        return self.length
+
+    def pages(self):
+        return self.shm.buf[:self.length * ITEM_SIZE].cast('q')
+
+    def chunks(self):
+        pages = self.pages()
+        for start in range(0, self.length, self.chunk_size):
+            yield pages[start:start + self.chunk_size]
+
+def share_trace(trace):
+    """Копіює трейс будь-якої форми у новий блок спільної пам'яті."""
+    length = len(trace)
+    shm = shared_memory.SharedMemory(create=True, size=max(1, length * ITEM_SIZE))
+    offset = 0
+    for chunk in (trace.chunks() if hasattr(trace, 'chunks') else (trace,)):
+        if np is not None:
+            raw = np.ascontiguousarray(chunk, dtype=np.int64)
+        else:
+            raw = array('q', chunk)
+        nbytes = len(raw) * ITEM_SIZE
+        shm.buf[offset:offset + nbytes] = memoryview(raw).cast('B')
+        offset += nbytes
+    return shm
+
+# Підключення до спільних трейсів у процесі-робітнику (ім'я -> SharedMemory)
+_attached = {}
+
+def _attach(name):
+    shm = _attached.get(name)
+    if shm is None:
+        # Робітники - дочірні процеси і ділять resource_tracker з батьківським,
+        # тому блок видаляється один раз, у sweep()
+        shm = shared_memory.SharedMemory(name=name)
+        _attached[name] = shm
+    return shm
+
+def _open_source(source, length):
+    # ('shm', ім'я) - згенерований трейс у спільній пам'яті, ('file', шлях) -
+    # файл трейсу, який кожен робітник відображає сам (сторінки спільні в кеші ОС)
+    kind, where = source
+    if kind == 'file':
+        return TraceFile(where)
+    return SharedTrace(_attach(where), length)
+
+def _sweep_job(job):
+    source, length, policy, cache_size, clock_bits, seed, samples = job
+    trace = _open_source(source, length)
+    start = time.perf_counter()
+    cpu = time.process_time()
+    p = make_policy(policy, cache_size, clock_bits=clock_bits, seed=seed, samples=samples).run(trace)
+    return {
+        'policy': policy,
+        'cache_size': cache_size,
+        'clock_bits': clock_bits,
+        'seed': seed,
+        'hit_rate': p.hit_rate(),
+        'seconds': time.perf_counter() - start,
+        'cpu_seconds': time.process_time() - cpu,
+    }
+
+def sweep(policies, cache_sizes, clock_bits, seeds, max_page, length, jobs=None, trace_file=None, samples=None):
+    """
+    Проганяє всю сітку конфігурацій на пулі з jobs процесів.
+    clock_bits стосується лише CLOCK (для інших політик - None).
+    samples - K для SLRU. З trace_file усі конфігурації читають цей файл,
+    а seed впливає лише на RAND і SLRU.
+    Повертає список словників, відсортований за (policy, cache_size, clock_bits, seed).
+    """
+    shared = {}
+    try:
+        sources = {}
+        for seed in seeds:
+            if trace_file is not None:
+                sources[seed] = ('file', trace_file)
+                length = len(TraceFile(trace_file))
+            else:
+                shared[seed] = share_trace(LocalityTrace(max_page, length, seed=seed))
+                sources[seed] = ('shm', shared[seed].name)
+        grid = []
+        for policy in policies:
+            for bits in (clock_bits if policy == 'CLOCK' else [None]):
+                for cache_size in cache_sizes:
+                    for seed in seeds:
+                        grid.append((sources[seed], length, policy, cache_size, bits, seed, samples))
+        with Pool(jobs) as pool:
+            results = list(pool.imap_unordered(_sweep_job, grid))
+    finally:
+        for shm in shared.values():
+            shm.close()
+            shm.unlink()
+    results.sort(key=lambda r: (r['policy'], r['cache_size'], r['clock_bits'] or 0, r['seed']))
+    return results
+
+# --- 5. Бінарні файли трейсів ---
+# Формат: 32-байтовий заголовок (магічне слово, версія, розмір елемента,
+# кількість звернень, розмір сторінки), далі масив номерів сторінок int64
+# little-endian. Файл читається через mmap шматками без копіювання, тому
+# трейси з реальних машин на десятки ГБ не займають пам'ять процесу.
+
+TRACE_MAGIC = b'PGTRACE\0'
+TRACE_VERSION = 1
+TRACE_HEADER = struct.Struct('<8sIIQQ')
+
+class TraceFile:
+    """Трейс із бінарного файлу, відображеного в пам'ять (mmap)."""
+    def __init__(self, path, chunk_size=CHUNK_SIZE):
+        assert sys.byteorder == 'little', "формат трейсу - little-endian"
+        self.path = path
+        self.chunk_size = chunk_size
+        with open(path, 'rb') as f:
+            header = f.read(TRACE_HEADER.size)
+            if len(header) < TRACE_HEADER.size:
+                raise ValueError(f"{path}: файл коротший за заголовок трейсу")
+            magic, version, item_size, self.length, self.page_size = TRACE_HEADER.unpack(header)
+            if magic != TRACE_MAGIC or version != TRACE_VERSION or item_size != ITEM_SIZE:
+                raise ValueError(f"{path}: не файл трейсу (або інша версія формату)")
+            if self.length == 0:
+                self.mm = None
+            else:
+                self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                if len(self.mm) < TRACE_HEADER.size + self.length * ITEM_SIZE:
+                    raise ValueError(f"{path}: файл обрізаний")
+
+    def __len__(self):
+        return self.length
+
+    def pages(self):
+        # Весь масив сторінок як memoryview (без копії)
+        if self.mm is None:
+            return memoryview(b'').cast('q')
+        start = TRACE_HEADER.size
+        return memoryview(self.mm)[start:start + self.length * ITEM_SIZE].cast('q')
+
+    def chunks(self):
+        pages = self.pages()
+        for start in range(0, self.length, self.chunk_size):
+            yield pages[start:start + self.chunk_size]
+
+class TraceWriter:
+    """Послідовний запис номерів сторінок у файл трейсу з буферизацією."""
+    def __init__(self, path, page_size=0):
+        self.f = open(path, 'wb')
+        self.page_size = page_size
+        self.length = 0
+        self.buf = array('q')
+        # Кількість звернень дописується в заголовок у close()
+        self.f.write(TRACE_HEADER.pack(TRACE_MAGIC, TRACE_VERSION, ITEM_SIZE, 0, page_size))
+
+    def append(self, page):
+        self.buf.append(page)
+        if len(self.buf) >= CHUNK_SIZE:
+            self.flush()
+
+    def extend(self, chunk):
+        if np is not None and hasattr(chunk, 'dtype'):
+            self.flush()
+            data = np.ascontiguousarray(chunk, dtype='<i8')
+            self.f.write(memoryview(data).cast('B'))
+            self.length += len(data)
+        else:
+            self.buf.extend(chunk)
+            if len(self.buf) >= CHUNK_SIZE:
+                self.flush()
+
+    def flush(self):
+        self.buf.tofile(self.f)
+        self.length += len(self.buf)
+        self.buf = array('q')
+
+    def close(self):
+        self.flush()
+        self.f.seek(0)
+        self.f.write(TRACE_HEADER.pack(TRACE_MAGIC, TRACE_VERSION, ITEM_SIZE, self.length, self.page_size))
+        self.f.close()
+
+def write_trace_file(path, trace, page_size=0):
+    """Записує трейс будь-якої форми у бінарний файл; повертає кількість звернень."""
+    writer = TraceWriter(path, page_size)
+    for chunk in (trace.chunks() if hasattr(trace, 'chunks') else (trace,)):
+        writer.extend(chunk)
+    writer.close()
+    return writer.length
+
+ADDRESS_DIGITS = {16: frozenset('0123456789abcdefABCDEF'), 10: frozenset('0123456789')}
+
+def parse_address(token, base=16):
+    # Одне правило для кожного токена: "0x..." - hex, решта - у системі base
+    # (16, як у lackey, або 10). Інакше голі "400000" і "abc" читалися б у
+    # різних системах. Що за цим правилом не розбирається - ValueError
+    digits = token
+    if token[:2] in ('0x', '0X'):
+        digits, base = token[2:], 16
+    if not digits or not set(digits) <= ADDRESS_DIGITS[base]:
+        raise ValueError(f"адреса {token!r} не є числом у системі {base}")
+    return int(digits, base)
+
+def convert_address_trace(src, dst, page_size=4096, addr_base=16):
+    """
+    Перетворює текстовий трейс адрес у файл номерів сторінок.
+    Підтримує дві форми рядків:
+      - одна адреса в рядку: з 0x - hex, без - у системі addr_base
+        (16 або 10, однаково для всього файлу);
+      - формат valgrind lackey: "I  04222cac,3", " L 7ff000398,8"
+        (I/L/S/M, hex-адреса, розмір); доступ через межу сторінки дає дві сторінки.
+    Рядки valgrind "==...", коментарі "#" і порожні рядки пропускаються.
+    Адреса, що не розбирається, дає ValueError з номером рядка.
+    Повертає кількість записаних звернень.
+    """
+    writer = TraceWriter(dst, page_size)
+    with open(src) as f:
+        for line_no, line in enumerate(f, 1):
+            tokens = line.split()
+            if not tokens or tokens[0].startswith(('==', '#')):
+                continue
+            try:
+                if len(tokens) == 2 and tokens[0] in ('I', 'L', 'S', 'M'):
+                    addr, _, size = tokens[1].partition(',')
+                    addr = parse_address(addr, 16)
+                    first = addr // page_size
+                    last = (addr + max(int(size or 1), 1) - 1) // page_size
+                    writer.append(first)
+                    if last != first:
+                        writer.append(last)
+                elif len(tokens) == 1:
+                    writer.append(parse_address(tokens[0], addr_base) // page_size)
+            except ValueError as e:
+                raise ValueError(f"{src}:{line_no}: {e}") from None
+    writer.close()
+    return writer.length
+
+def read_pages(stream, binary=False, block_size=1 << 20):
+    """
+    Читає номери сторінок з потоку (напр. sys.stdin.buffer) блоками по
+    block_size байтів і віддає їх пачками (списками int), щойно блок
+    прочитано. Текст - десяткові числа через пробіли/переводи рядків; binary - сирі
+    int64 little-endian, як у файлі трейсу без заголовка. Обірване на межі
+    блоку число переноситься в наступний блок, тож пам'ять не росте з
+    довжиною потоку.
+    """
+    carry = b''
+    while True:
+        data = stream.read1(block_size) if hasattr(stream, 'read1') else stream.read(block_size)
+        if not data:
+            break
+        data = carry + data
+        if binary:
+            whole = len(data) - len(data) % ITEM_SIZE
+            carry = data[whole:]
+            if whole:
+                yield memoryview(data)[:whole].cast('q').tolist()
+        else:
+            # Останнє число могло обірватися посередині
+            cut = max(data.rfind(b' '), data.rfind(b'\n'), data.rfind(b'\t'))
+            carry = data[cut + 1:]
+            pages = data[:cut + 1].split()
+            if pages:
+                yield [int(p) for p in pages]
+    if carry and not binary and carry.strip():
+        yield [int(p) for p in carry.split()]
+
+# --- 6. Адаптивна зупинка за довірчими інтервалами ---
+# Замість фіксованого TRACE_LEN для кожного seed: кілька потоків (seed)
+# проходяться блоками, hit rate кожного блоку - одне спостереження.
+# Після кожного раунду (по блоку з кожного потоку) рахуються довірчі
+# інтервали середнього для кожної політики й для попарних різниць (парні
+# спостереження на тому самому блоці, тому різниці вужчі за самі рівні).
+# Щойно всі інтервали вужчі за задану ширину - зупиняємось.
+
+ADAPTIVE_STREAMS = 4  # seed за замовчуванням: -s, -s + 1, ...
+
+def t_quantile(df, confidence):
+    # Квантиль t-розподілу: нормальний квантиль з поправкою Корніша-Фішера
+    # (похибка < 1% уже з df = 3)
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+    return (z + (z**3 + z) / (4 * df) + (5 * z**5 + 16 * z**3 + 3 * z) / (96 * df**2)
+            + (3 * z**7 + 19 * z**5 + 17 * z**3 - 15 * z) / (384 * df**3))
+
+def confidence_interval(values, confidence=0.95):
+    """Повертає (середнє, півширина) інтервалу для середнього values."""
+    n = len(values)
+    mean = sum(values) / n
+    if n < 2:
+        return mean, float('inf')
+    var = sum((v - mean) ** 2 for v in values) / (n - 1)
+    return mean, t_quantile(n - 1, confidence) * (var / n) ** 0.5
+
+def iter_blocks(trace, size):
+    # Шматки трейсу, переріз на блоки рівно по size звернень (останній коротший)
+    buf = []
+    for chunk in iter_chunks(trace):
+        pos = 0
+        while pos < len(chunk):
+            piece = chunk[pos:pos + size - len(buf)]
+            buf.extend(piece)
+            pos += len(piece)
+            if len(buf) == size:
+                yield buf
+                buf = []
+    if buf:
+        yield buf
+
+def adaptive_compare(make_policies, traces, block, width, confidence=0.95, min_rounds=2):
+    """
+    make_policies() - новий набір політик (свій для кожного потоку);
+    traces - по трейсу на потік. Повертає словник:
+      labels, levels ({мітка: (середнє, півширина)}), diffs ({(a, b): ...}),
+      blocks, accesses, converged.
+    """
+    streams = [(make_policies(), iter_blocks(t, block)) for t in traces]
+    labels = [p.label for p in streams[0][0]]
+    samples = {label: [] for label in labels}
+    pairs = [(a, b) for i, a in enumerate(labels) for b in labels[i + 1:]]
+    blocks = accesses = rounds = 0
+    converged = False
+
+    while streams and not converged:
+        alive = []
+        for policies, it in streams:
+            chunk = next(it, None)
+            if chunk is None:
+                continue
+            alive.append((policies, it))
+            for p in policies:
+                hits = p.hits
+                p._run(chunk)
+                samples[p.label].append((p.hits - hits) / len(chunk) * 100)
+            blocks += 1
+            accesses += len(chunk)
+        streams = alive
+        rounds += 1
+        if rounds < min_rounds:
+            continue
+        levels = {label: confidence_interval(samples[label], confidence) for label in labels}
+        diffs = {(a, b): confidence_interval([x - y for x, y in zip(samples[a], samples[b])], confidence)
+                 for a, b in pairs}
+        converged = all(2 * h <= width for _, h in list(levels.values()) + list(diffs.values()))
+
+    if rounds < min_rounds:
+        levels = {label: confidence_interval(samples[label], confidence) for label in labels}
+        diffs = {(a, b): confidence_interval([x - y for x, y in zip(samples[a], samples[b])], confidence)
+                 for a, b in pairs}
+    return {'labels': labels, 'levels': levels, 'diffs': diffs,
+            'blocks': blocks, 'accesses': accesses, 'converged': converged}
+
+# --- 7. Кілька орендарів в одному кеші ---
+# Незалежні трейси орендарів (кожен - своя модель навантаження і свій seed)
+# перемежовуються випадково з заданими частками звернень. Сторінки
+# орендарів не перетинаються: сторінка p орендаря i стає p * T + i. Кожна
+# політика проганяється трьома способами: спільний кеш на всіх, статичні
+# розділи (кеш ділиться за частками) і кожен орендар сам на весь кеш.
+# Втрата відносно "сам на весь кеш" і є взаємним впливом орендарів.
+
+def interleave_tenants(traces, rates, seed=0, block=CHUNK_SIZE):
+    """
+    Віддає блоки (which, parts): which[j] - орендар j-го звернення злитого
+    трейсу, parts[i] - сторінки орендаря i в цьому блоці (уже з міткою
+    орендаря). Закінчується, щойно вичерпався трейс будь-якого орендаря.
+    """
+    count = len(traces)
+    rng = random.Random(seed)
+    total = float(sum(rates))
+    cum = []
+    acc = 0.0
+    for r in rates:
+        acc += r / total
+        cum.append(acc)
+    streams = [iter_blocks(t, block) for t in traces]
+    buffers = [[] for _ in traces]
+    while True:
+        which = [min(bisect_right(cum, rng.random()), count - 1) for _ in range(block)]
+        parts = []
+        for i in range(count):
+            need = which.count(i)
+            while len(buffers[i]) < need:
+                chunk = next(streams[i], None)
+                if chunk is None:
+                    return
+                buffers[i].extend(p * count + i for p in chunk)
+            parts.append(buffers[i][:need])
+            del buffers[i][:need]
+        yield which, parts
+
+def partition_sizes(cache_size, shares):
+    # Розміри розділів пропорційно shares, сума рівно cache_size (інакше
+    # розділені орендарі мали б більше кешу, ніж спільний): цілі частини,
+    # а решту кадрів - розділам з найбільшими дробовими частинами.
+    # Розділ, якому не дісталося жодного кадру, - помилка
+    total = float(sum(shares))
+    exact = [cache_size * s / total for s in shares]
+    sizes = [int(x) for x in exact]
+    order = sorted(range(len(shares)), key=lambda i: sizes[i] - exact[i])
+    for i in order[:cache_size - sum(sizes)]:
+        sizes[i] += 1
+    for share, size in zip(shares, sizes):
+        if size < 1:
+            raise ValueError(f"частка {share:g} дає 0 кадрів із {cache_size}")
+    return sizes
+
+def tenant_compare(make, traces, rates, shares, cache_size, length, seed=0, block=10000):
+    """
+    make(cache_size) - нова політика. Повертає словник
+    {'shared': [hit rate % орендаря i], 'partitioned': [...], 'alone': [...],
+     'accesses': [звернень орендаря i], 'sizes': розміри розділів,
+     'total': hit rate % спільного кешу}.
+    """
+    count = len(traces)
+    sizes = partition_sizes(cache_size, shares)
+    shared = make(cache_size)
+    parted = [make(size) for size in sizes]
+    alone = [make(cache_size) for _ in range(count)]
+    shared_hits = [0] * count
+    accesses = [0] * count
+    done = 0
+
+    for which, parts in interleave_tenants(traces, rates, seed, block):
+        which = which[:length - done]
+        # Спільний кеш: послідовні звернення одного орендаря - одним викликом
+        pos = [0] * count
+        j = 0
+        while j < len(which):
+            i = which[j]
+            run = j + 1
+            while run < len(which) and which[run] == i:
+                run += 1
+            piece = parts[i][pos[i]:pos[i] + run - j]
+            pos[i] += len(piece)
+            hits = shared.hits
+            shared._run(piece)
+            shared_hits[i] += shared.hits - hits
+            accesses[i] += len(piece)
+            j = run
+        for i in range(count):
+            piece = parts[i][:pos[i]]
+            parted[i]._run(piece)
+            alone[i]._run(piece)
+        done += len(which)
+        if done >= length:
+            break
+
+    def rate(hits, n):
+        return hits / n * 100 if n else 0.0
+
+    return {
+        'shared': [rate(shared_hits[i], accesses[i]) for i in range(count)],
+        'partitioned': [p.hit_rate() for p in parted],
+        'alone': [p.hit_rate() for p in alone],
+        'accesses': accesses,
+        'sizes': sizes,
+        'total': shared.hit_rate(),
+    }
+
+# --- 8. Запуск експерименту ---
 
 # Параметри
 TRACE_LEN = 10000
 MAX_PAGE = 100
 CACHE_SIZE = 25  # Маленький кеш, щоб було багато витіснень
 
-print(f"Генерація трейсу ({TRACE_LEN} звернень, {MAX_PAGE} сторінок, кеш={CACHE_SIZE})...")
-print("Тип: 80% звернень до 20% адресного простору (локальність).")
-
-trace = generate_locality_trace(MAX_PAGE, TRACE_LEN)
-
-# Розрахунки
-lru_hit = solve_lru(trace, cache_size=CACHE_SIZE)
-rand_hit = solve_rand(trace, cache_size=CACHE_SIZE)
-clock_1_hit = solve_clock(trace, cache_size=CACHE_SIZE, clock_bits=1)
-clock_2_hit = solve_clock(trace, cache_size=CACHE_SIZE, clock_bits=2)
-clock_3_hit = solve_clock(trace, cache_size=CACHE_SIZE, clock_bits=3)
-
-# Вивід результатів
-print("-" * 30)
-print(f"LRU Hit Rate:        {lru_hit:.2f}%")
-print(f"RAND Hit Rate:       {rand_hit:.2f}%")
-print(f"CLOCK (1 bit) Hit:   {clock_1_hit:.2f}%")
-print(f"CLOCK (2 bits) Hit:  {clock_2_hit:.2f}%")
-print(f"CLOCK (3 bits) Hit:  {clock_3_hit:.2f}%")
-print("-" * 30)
-
-print("\nВисновки:")
-diff = lru_hit - rand_hit
-print(f"1. LRU краще за RAND на {diff:.2f}%.")
-if clock_1_hit >= lru_hit - 1:
-    print("2. CLOCK працює майже так само добре, як LRU.")
-else:
-    print("2. CLOCK трохи гірше LRU, але краще RAND.")
+def make_trace(options):
+    # -t: готовий файл трейсу (mmap)
+    if options.traceFile:
+        return TraceFile(options.traceFile)
+    # -W: трейс з моделі навантаження (див. parse_workload)
+    if options.workload:
+        seed = options.seed if options.seed is not None else random.randrange(2**32)
+        return WorkloadTrace(options.workload, options.length, seed=seed, chunk_size=options.chunkSize or CHUNK_SIZE)
+    # -k N: потоковий трейс шматками по N звернень, пам'ять не росте з -l
+    if options.chunkSize > 0:
+        seed = options.seed if options.seed is not None else random.randrange(2**32)
+        return LocalityTrace(options.maxPage, options.length, seed=seed, chunk_size=options.chunkSize)
+    return generate_locality_trace(options.maxPage, options.length)
+
+def make_monitor(options):
+    # --window N: рядок лічильників на кожні N звернень (у --windowOut або stdout)
+    if options.window <= 0:
+        return None
+    if options.windowOut:
+        return WindowMonitor(open(options.windowOut, 'w'), options.window, options.windowFormat, owns=True)
+    return WindowMonitor(sys.stdout, options.window, options.windowFormat)
+
+def checkpoint_meta(options, trace):
+    # Що має збігатися, щоб продовжити прогін з контрольної точки
+    return {'length': len(trace), 'seed': options.seed, 'maxPage': options.maxPage,
+            'workload': options.workload, 'traceFile': options.traceFile,
+            'cacheSize': options.cacheSize, 'chunkSize': options.chunkSize}
+
+def run_compare(options):
+    # Після збою трейс має відтворитися точно таким самим
+    assert not options.checkpoint or options.seed is not None or options.traceFile, \
+        "--checkpoint потребує -s або -t"
+    trace = make_trace(options)
+    if options.traceFile:
+        print(f"Трейс з файлу {options.traceFile} ({len(trace)} звернень, кеш={options.cacheSize})...")
+    elif options.workload:
+        print(f"Трейс з моделі {options.workload} ({len(trace)} звернень, кеш={options.cacheSize})...")
+    else:
+        print(f"Генерація трейсу ({options.length} звернень, {options.maxPage} сторінок, кеш={options.cacheSize})...")
+        print("Тип: 80% звернень до 20% адресного простору (локальність).")
+
+    cache_size = options.cacheSize
+
+    # Розрахунки (з --window ще й віконні лічильники кожної політики)
+    monitor = make_monitor(options)
+    # Файл --windowOut закривається й тоді, коли прогін упав
+    try:
+        # OPT тримає весь трейс і next_use (16 байтів на звернення), тож для
+        # потокового трейсу чи файлу він лише на вимогу (--opt)
+        streamed = hasattr(trace, 'chunks')
+        opt_hit = solve_opt(trace, cache_size=cache_size) if options.opt or not streamed else None
+        if options.checkpoint:
+            # Решта політик іде пліч-о-пліч зі збереженням стану (OPT потребує
+            # всього трейсу наперед, тому рахується окремо й без точок)
+            assert monitor is None, "--checkpoint не поєднується з --window"
+            policies = [LRUPolicy(cache_size), RandPolicy(cache_size),
+                        ClockPolicy(cache_size, clock_bits=1), ClockPolicy(cache_size, clock_bits=2),
+                        ClockPolicy(cache_size, clock_bits=3), ARCPolicy(cache_size),
+                        TwoQPolicy(cache_size), LFUPolicy(cache_size), LIRSPolicy(cache_size)]
+            policies = run_with_checkpoints(policies, trace, options.checkpoint,
+                                            options.checkpointEvery, checkpoint_meta(options, trace))
+            (lru_hit, rand_hit, clock_1_hit, clock_2_hit, clock_3_hit,
+             arc_hit, twoq_hit, lfu_hit, lirs_hit) = [p.hit_rate() for p in policies]
+        else:
+            lru_hit = solve_lru(trace, cache_size=cache_size, monitor=monitor)
+            rand_hit = solve_rand(trace, cache_size=cache_size, monitor=monitor)
+            clock_1_hit = solve_clock(trace, cache_size=cache_size, clock_bits=1, monitor=monitor)
+            clock_2_hit = solve_clock(trace, cache_size=cache_size, clock_bits=2, monitor=monitor)
+            clock_3_hit = solve_clock(trace, cache_size=cache_size, clock_bits=3, monitor=monitor)
+            arc_hit = solve_arc(trace, cache_size=cache_size, monitor=monitor)
+            twoq_hit = solve_2q(trace, cache_size=cache_size, monitor=monitor)
+            lfu_hit = solve_lfu(trace, cache_size=cache_size, monitor=monitor)
+            lirs_hit = solve_lirs(trace, cache_size=cache_size, monitor=monitor)
+    finally:
+        if monitor is not None:
+            monitor.close()
+
+    # Вивід результатів
+    print("-" * 30)
+    if opt_hit is not None:
+        print(f"OPT Hit Rate:        {opt_hit:.2f}%")
+    else:
+        print("OPT Hit Rate:        - (потоковий трейс; --opt, щоб порахувати)")
+    print(f"LRU Hit Rate:        {lru_hit:.2f}%")
+    print(f"RAND Hit Rate:       {rand_hit:.2f}%")
+    print(f"CLOCK (1 bit) Hit:   {clock_1_hit:.2f}%")
+    print(f"CLOCK (2 bits) Hit:  {clock_2_hit:.2f}%")
+    print(f"CLOCK (3 bits) Hit:  {clock_3_hit:.2f}%")
+    print(f"ARC Hit Rate:        {arc_hit:.2f}%")
+    print(f"2Q Hit Rate:         {twoq_hit:.2f}%")
+    print(f"LFU Hit Rate:        {lfu_hit:.2f}%")
+    print(f"LIRS Hit Rate:       {lirs_hit:.2f}%")
+    print("-" * 30)
+
+    print("\nВисновки:")
+    diff = lru_hit - rand_hit
+    print(f"1. LRU краще за RAND на {diff:.2f}%.")
+    if clock_1_hit >= lru_hit - 1:
+        print("2. CLOCK працює майже так само добре, як LRU.")
+    else:
+        print("2. CLOCK трохи гірше LRU, але краще RAND.")
+    if opt_hit is not None:
+        print(f"3. До оптимуму (OPT) LRU бракує {opt_hit - lru_hit:.2f}%, CLOCK (1 bit) - {opt_hit - clock_1_hit:.2f}%.")
+
+def run_mrc(options):
+    trace = make_trace(options)
+    if options.traceFile:
+        print(f"Трейс з файлу {options.traceFile} ({len(trace)} звернень)...")
+    elif options.workload:
+        print(f"Трейс з моделі {options.workload} ({len(trace)} звернень)...")
+    else:
+        print(f"Генерація трейсу ({options.length} звернень, {options.maxPage} сторінок)...")
+
+    # Один прохід замість окремого solve_lru для кожного розміру кешу
+    rates = lru_mrc(trace)
+    print(f"Найбільша стекова відстань: {len(rates) - 1} (більший кеш не додає влучань)")
+    print("cache_size,hit_rate,miss_rate")
+    for c in range(1, len(rates)):
+        print(f"{c},{rates[c]:.2f},{100 - rates[c]:.2f}")
+
+def run_shards(options):
+    trace = make_trace(options)
+    if options.traceFile:
+        print(f"Трейс з файлу {options.traceFile} ({len(trace)} звернень)...")
+    elif options.workload:
+        print(f"Трейс з моделі {options.workload} ({len(trace)} звернень)...")
+    else:
+        print(f"Генерація трейсу ({options.length} звернень, {options.maxPage} сторінок)...")
+
+    sizes = [int(c) for c in options.cacheSizes.split(',')] if options.cacheSizes else None
+    sizes, rates, errors, info = shards_mrc(trace, rate=options.rate, max_pages=options.maxPages, sizes=sizes)
+    print(f"Вибірка: частота {info['rate']:.6f}, сторінок у вибірці {info['pages']}, звернень {info['total']}")
+    print("cache_size,hit_rate,miss_rate,stderr")
+    for c, h, e in zip(sizes, rates, errors):
+        print(f"{c},{h:.2f},{100 - h:.2f},{e:.2f}")
+
+def run_stream(options):
+    # Живий режим: сторінки з stdin, кілька політик пліч-о-пліч, кожні
+    # --every звернень - рядок із загальним і останнім (у дужках) hit rate
+    policies = []
+    for name in options.policies.split(','):
+        assert name in POLICIES, f"невідома політика {name}"
+        assert name != 'OPT', "OPT потребує всього трейсу наперед і не працює з потоком"
+        for bits in ([int(b) for b in options.clockBits.split(',')] if name == 'CLOCK' else [None]):
+            policies.append(make_policy(name, options.cacheSize, clock_bits=bits, seed=options.seed, samples=options.samples))
+    every = options.every
+    last = [(p.hits, p.accesses) for p in policies]
+    since = 0
+
+    def report():
+        parts = []
+        for i, p in enumerate(policies):
+            hits, accesses = last[i]
+            recent = (p.hits - hits) / (p.accesses - accesses) * 100 if p.accesses > accesses else 0.0
+            parts.append(f"{p.label} {p.hit_rate():6.2f}% ({recent:6.2f}%)")
+            last[i] = (p.hits, p.accesses)
+        print(f"{policies[0].accesses:>12} | " + " | ".join(parts), flush=True)
+
+    print(f"Читання сторінок зі stdin, кеш={options.cacheSize}; hit rate: загальний (за останні {every})", flush=True)
+    for batch in read_pages(sys.stdin.buffer, binary=options.binary):
+        pos = 0
+        while pos < len(batch):
+            piece = batch[pos:pos + every - since]
+            for p in policies:
+                p.run(piece)
+            pos += len(piece)
+            since += len(piece)
+            if since == every:
+                report()
+                since = 0
+    if since:
+        report()
+
+def run_sweep(options):
+    policies = options.policies.split(',')
+    cache_sizes = [int(c) for c in options.cacheSizes.split(',')] if options.cacheSizes else [options.cacheSize]
+    clock_bits = [int(b) for b in options.clockBits.split(',')]
+    seeds = [int(s) for s in options.seeds.split(',')] if options.seeds else [options.seed or 0]
+    for policy in policies:
+        assert policy in POLICIES, f"невідома політика {policy}"
+
+    length = len(TraceFile(options.traceFile)) if options.traceFile else options.length
+    print(f"Перебір: {len(policies)} політик, {len(cache_sizes)} розмірів кешу, {len(seeds)} seed, трейс {length} звернень")
+    start = time.perf_counter()
+    results = sweep(policies, cache_sizes, clock_bits, seeds, options.maxPage, options.length,
+                    jobs=options.jobs, trace_file=options.traceFile or None, samples=options.samples)
+    elapsed = time.perf_counter() - start
+
+    print("policy,cache_size,clock_bits,seed,hit_rate,seconds")
+    for r in results:
+        bits = r['clock_bits'] if r['clock_bits'] is not None else ''
+        print(f"{r['policy']},{r['cache_size']},{bits},{r['seed']},{r['hit_rate']:.2f},{r['seconds']:.3f}")
+    # Сума часу на стіні по задачах показала б лише, скільки їх ішло
+    # одночасно (навіть на одному ядрі); процесорний час - справжню роботу
+    cpu = sum(r['cpu_seconds'] for r in results)
+    print(f"Конфігурацій: {len(results)}, час: {elapsed:.2f} с, процесорний час робітників: {cpu:.2f} с "
+          f"(в середньому {cpu / elapsed:.1f} ядра зайняті)")
+
+def run_adaptive(options):
+    names = options.policies.split(',')
+    for name in names:
+        assert name in POLICIES, f"невідома політика {name}"
+        assert name != 'OPT', "OPT потребує всього трейсу наперед і не працює блоками"
+    bits = [int(b) for b in options.clockBits.split(',')]
+
+    def make_policies():
+        return [make_policy(name, options.cacheSize, clock_bits=b, seed=options.seed, samples=options.samples)
+                for name in names for b in (bits if name == 'CLOCK' else [None])]
+
+    block = options.chunkSize or TRACE_LEN // 10
+    # Потоки: файл трейсу - один; інакше по трейсу довжиною до -l на кожен seed
+    base = options.seed if options.seed is not None else 0
+    seeds = [int(s) for s in options.seeds.split(',')] if options.seeds else \
+        [base + i for i in range(ADAPTIVE_STREAMS)]
+    if options.traceFile:
+        traces = [TraceFile(options.traceFile)]
+    elif options.workload:
+        traces = [WorkloadTrace(options.workload, options.length, seed=s, chunk_size=block) for s in seeds]
+    else:
+        traces = [LocalityTrace(options.maxPage, options.length, seed=s, chunk_size=block) for s in seeds]
+    budget = sum(len(t) for t in traces)
+
+    print(f"Адаптивне порівняння: {len(traces)} потоків, блок {block} звернень, "
+          f"ціль - інтервали {options.confidence * 100:.0f}% вужчі за {options.ciWidth} п.п.")
+    start = time.perf_counter()
+    r = adaptive_compare(make_policies, traces, block, options.ciWidth, options.confidence)
+    elapsed = time.perf_counter() - start
+
+    print("policy,hit_rate,low,high,width")
+    for label in r['labels']:
+        mean, h = r['levels'][label]
+        print(f"{label},{mean:.2f},{mean - h:.2f},{mean + h:.2f},{2 * h:.2f}")
+    print("difference,mean,low,high,width")
+    for (a, b), (mean, h) in r['diffs'].items():
+        print(f"{a}-{b},{mean:+.2f},{mean - h:+.2f},{mean + h:+.2f},{2 * h:.2f}")
+    used = r['accesses'] / budget * 100 if budget else 0.0
+    print(f"Використано: {r['blocks']} блоків, {r['accesses']} з {budget} звернень ({used:.1f}%), {elapsed:.2f} с")
+    if r['converged']:
+        print("Усі інтервали вужчі за ціль - зупинено достроково.")
+    else:
+        print("Трейс вичерпано раніше, ніж інтервали звузилися до цілі (збільште -l або --seeds).")
+
+def run_tenants(options):
+    assert options.tenants, "потрібен --tenants"
+    specs = options.tenants.split(';')
+    rates = [float(r) for r in options.tenantRates.split(',')] if options.tenantRates else [1.0] * len(specs)
+    shares = [float(s) for s in options.tenantShares.split(',')] if options.tenantShares else rates
+    assert len(rates) == len(specs) and len(shares) == len(specs), \
+        "--tenantRates і --tenantShares - по числу на орендаря"
+    names = options.policies.split(',')
+    for name in names:
+        assert name in POLICIES, f"невідома політика {name}"
+        assert name != 'OPT', "OPT потребує всього трейсу наперед"
+    bits = [int(b) for b in options.clockBits.split(',')]
+
+    # Кожен орендар може отримати не більше -l звернень
+    base = options.seed if options.seed is not None else random.randrange(2**32)
+    traces = [WorkloadTrace(spec, options.length, seed=base + i, chunk_size=options.chunkSize or 10**5)
+              for i, spec in enumerate(specs)]
+    sizes = partition_sizes(options.cacheSize, shares)
+    print(f"Орендарів: {len(specs)}, кеш={options.cacheSize} (розділи {'/'.join(map(str, sizes))}), "
+          f"трейс {options.length} звернень, seed={base}")
+    for i, spec in enumerate(specs):
+        print(f"  {i}: {spec} (частка звернень {rates[i] / sum(rates) * 100:.0f}%)")
+
+    print("policy,tenant,accesses,alone,partitioned,shared,interference")
+    for name in names:
+        for b in (bits if name == 'CLOCK' else [None]):
+            def make(size):
+                return make_policy(name, size, clock_bits=b, seed=options.seed, samples=options.samples)
+            r = tenant_compare(make, traces, rates, shares, options.cacheSize, options.length, seed=base)
+            label = make(1).label
+            for i in range(len(specs)):
+                # Взаємний вплив: скільки орендар втрачає у спільному кеші
+                # порівняно з кешем лише для себе
+                print(f"{label},{i},{r['accesses'][i]},{r['alone'][i]:.2f},{r['partitioned'][i]:.2f},"
+                      f"{r['shared'][i]:.2f},{r['alone'][i] - r['shared'][i]:.2f}")
+            print(f"{label},all,{sum(r['accesses'])},,,{r['total']:.2f},")
+
+def run_convert(options):
+    assert options.output, "потрібен --output"
+    if options.input:
+        # Текстовий трейс адрес -> номери сторінок
+        count = convert_address_trace(options.input, options.output, options.pageSize, int(options.addrBase))
+        print(f"{options.input} -> {options.output}: {count} звернень, сторінка {options.pageSize} байтів")
+    else:
+        # Без --input зберігаємо згенерований трейс з локальністю
+        seed = options.seed if options.seed is not None else random.randrange(2**32)
+        count = write_trace_file(options.output, LocalityTrace(options.maxPage, options.length, seed=seed))
+        print(f"Згенеровано {options.output}: {count} звернень, seed={seed}")
+
+MODES = {
+    'compare': run_compare,
+    'mrc': run_mrc,
+    'shards': run_shards,
+    'sweep': run_sweep,
+    'convert': run_convert,
+    'stream': run_stream,
+    'adaptive': run_adaptive,
+    'tenants': run_tenants,
+}
+
+def main():
+    parser = OptionParser()
+    parser.add_option("-s", "--seed", dest="seed", help="random seed (default: random)", default=None, type="int")
+    parser.add_option("-l", "--length", dest="length", help="trace length", default=TRACE_LEN, type="int")
+    parser.add_option("-p", "--maxPage", dest="maxPage", help="largest page number", default=MAX_PAGE, type="int")
+    parser.add_option("-C", "--cacheSize", dest="cacheSize", help="cache size in frames", default=CACHE_SIZE, type="int")
+    parser.add_option("-t", "--traceFile", dest="traceFile", help="read the trace from a binary trace file (see -m convert)", default="", type="string")
+    parser.add_option("-W", "--workload", dest="workload", help="workload model, e.g. 'zipf:n=1000:alpha=0.9:w=0.8+scan:w=0.2' or 'loop:n=50@10000/hotcold:max=100@10000'", default="", type="string")
+    parser.add_option("-k", "--chunkSize", dest="chunkSize", help="generate the trace lazily in chunks of this size (0: whole trace in memory); adaptive: block size", default=0, type="int")
+    parser.add_option("--opt", dest="opt", help="compare: run OPT on a streamed trace (-k, -W, -t) too; it holds 16 bytes per access in memory", default=False, action="store_true")
+    parser.add_option("-w", "--window", dest="window", help="compare: per-window counters every N accesses (0: off)", default=0, type="int")
+    parser.add_option("--windowFormat", dest="windowFormat", help="compare: window output format (csv or json)", default="csv", type="choice", choices=["csv", "json"])
+    parser.add_option("--windowOut", dest="windowOut", help="compare: write window counters to this file (default: stdout)", default="", type="string")
+    parser.add_option("--checkpoint", dest="checkpoint", help="compare: save policy state to this file and resume from it if it exists", default="", type="string")
+    parser.add_option("--checkpointEvery", dest="checkpointEvery", help="compare: accesses between checkpoints", default=10**6, type="int")
+    parser.add_option("--rate", dest="rate", help="shards: sampling rate", default=0.01, type="float")
+    parser.add_option("--maxPages", dest="maxPages", help="shards: fixed memory budget in sampled pages (0: fixed rate)", default=0, type="int")
+    parser.add_option("--every", dest="every", help="stream: report hit rates every N accesses", default=100000, type="int")
+    parser.add_option("--binary", dest="binary", help="stream: stdin carries raw little-endian int64 page ids", default=False, action="store_true")
+    parser.add_option("--ciWidth", dest="ciWidth", help="adaptive: stop once every confidence interval is narrower than this (percentage points)", default=1.0, type="float")
+    parser.add_option("--confidence", dest="confidence", help="adaptive: confidence level", default=0.95, type="float")
+    parser.add_option("--samples", dest="samples", help="SLRU: eviction candidates sampled per miss", default=SLRU_SAMPLES, type="int")
+    parser.add_option("--tenants", dest="tenants", help="tenants: ';'-separated workload models, one per tenant (see -W)", default="", type="string")
+    parser.add_option("--tenantRates", dest="tenantRates", help="tenants: comma-separated relative access rates (default: equal)", default="", type="string")
+    parser.add_option("--tenantShares", dest="tenantShares", help="tenants: comma-separated cache partition shares (default: the rates)", default="", type="string")
+    parser.add_option("--policies", dest="policies", help="sweep, stream, adaptive, tenants: comma-separated policies", default="LRU,RAND,CLOCK", type="string")
+    parser.add_option("--cacheSizes", dest="cacheSizes", help="sweep, shards: comma-separated cache sizes (sweep default: -C)", default="", type="string")
+    parser.add_option("--clockBits", dest="clockBits", help="sweep, stream, adaptive, tenants: comma-separated CLOCK bit counts", default="1,2,3", type="string")
+    parser.add_option("--seeds", dest="seeds", help="sweep, adaptive: comma-separated trace seeds (default: -s or 0; adaptive: 4 seeds from -s)", default="", type="string")
+    parser.add_option("-j", "--jobs", dest="jobs", help="sweep: worker processes (default: all cores)", default=None, type="int")
+    parser.add_option("--input", dest="input", help="convert: text address trace (one address per line or valgrind lackey)", default="", type="string")
+    parser.add_option("--output", dest="output", help="convert: binary trace file to write", default="", type="string")
+    parser.add_option("--addrBase", dest="addrBase", help="convert: base of addresses without 0x (16 or 10)", default="16", type="choice", choices=["16", "10"])
+    parser.add_option("--pageSize", dest="pageSize", help="convert: page size in bytes", default=4096, type="int")
+    parser.add_option("-m", "--mode", dest="mode", help="one of: " + ", ".join(MODES), default="compare", type="choice", choices=list(MODES))
+    (options, args) = parser.parse_args()
+
+    random.seed(options.seed)
+    MODES[options.mode](options)
+
+if __name__ == "__main__":
+    main()
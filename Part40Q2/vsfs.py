@@ -1,44 +1,224 @@
 #!/usr/bin/env python3
 
+import hashlib
+import itertools
+import mmap
+import os
 import random
+import re
+import shutil
+import struct
+import sys
+import tempfile
+import time
+import zlib
+from array import array
+from collections import OrderedDict
 from optparse import OptionParser
 
 # --- Class Definitions ---
 
 class bitmap:
-    def __init__(self, size):
+    # Bits are packed 64 to a word (bit i is bit i%64 of word i//64); the
+    # padding bits past 'size' in the last word are kept set so a search
+    # never returns them. Searches skip whole runs of full (or empty) words
+    # with a regex over the raw bytes, so they run at C speed.
+    WORD = 64
+    FULL = (1 << 64) - 1
+    NOT_FULL = re.compile(rb'[^\xff]')
+    NOT_EMPTY = re.compile(rb'[^\x00]')
+    POLICIES = ('first', 'next', 'random', 'best')
+
+    def __init__(self, size, policy='first', rng=None, words=None, numFree=None):
+        # words/numFree: an existing bitmap (e.g. a memoryview into an image)
+        assert(policy in bitmap.POLICIES)
         self.size = size
-        self.bmap = []
-        for i in range(size):
-            self.bmap.append(0)
-
-    def alloc(self):
-        for i in range(len(self.bmap)):
-            if self.bmap[i] == 0:
-                self.bmap[i] = 1
-                return i
+        self.policy = policy
+        self.rng = rng if rng is not None else random.Random(0)
+        nwords = (size + bitmap.WORD - 1) // bitmap.WORD
+        self.hint = 0    # first-fit: no free bit lives in a word below this one
+        self.cursor = 0  # next-fit: where the last allocation ended
+        if words is None:
+            self.words = array('Q', bytes(8 * nwords))
+            if size % bitmap.WORD:
+                self.words[-1] = bitmap.FULL & ~((1 << (size % bitmap.WORD)) - 1)
+            self.top = 0     # words from here on have never been allocated
+            self.numFree = size
+        else:
+            assert(len(words) == nwords)
+            self.words = words
+            self.top = nwords
+            self.numFree = numFree
+        self.raw = memoryview(self.words).cast('B')
+        self.touched = None  # bit -> value before its first change (see fs.trackChanges)
+        # with a buffer cache (fs.useBufferCache), reads and writes of bits
+        # are counted as block I/O on dev; searches are not: the summary
+        # they use (hint, top, numFree) is kept in memory
+        self.dev = None
+        self.region = None
+
+    def isAllocated(self, num):
+        if self.dev is not None:
+            self.dev.bits(self.region, num, num)
+        return (self.words[num >> 6] >> (num & 63)) & 1 == 1
+
+    def _set(self, start, count):
+        if self.dev is not None:
+            self.dev.bits(self.region, start, start + count - 1, True)
+        for num in range(start, start + count):
+            self.words[num >> 6] |= 1 << (num & 63)
+            if self.touched is not None:
+                self.touched.setdefault(num, 0)
+        self.numFree -= count
+        self.top = max(self.top, ((start + count - 1) >> 6) + 1)
+
+    def findFree(self, start=0, end=None):
+        # first free bit in [start, end), or -1
+        if end is None:
+            end = self.size
+        if start >= end:
+            return -1
+        words = self.words
+        w = start >> 6
+        # bits below start in the first word count as taken
+        free = ~(words[w] | ((1 << (start & 63)) - 1)) & bitmap.FULL
+        if free == 0:
+            m = bitmap.NOT_FULL.search(self.raw, 8 * (w + 1), 8 * (((end - 1) >> 6) + 1))
+            if m is None:
+                return -1
+            w = m.start() >> 3
+            free = ~words[w] & bitmap.FULL
+        num = (w << 6) + (free & -free).bit_length() - 1
+        return num if num < end else -1
+
+    def freeRuns(self, start=0):
+        # yields (start, length) for each maximal run of free bits at or after start
+        words = self.words
+        runStart = -1
+        num = start
+        while num < self.size:
+            w = num >> 6
+            if w >= self.top:
+                # never-touched tail: one free run to the end, no need to scan it
+                if runStart == -1:
+                    runStart = num
+                num = self.size
+                break
+            word = words[w]
+            if (num & 63) == 0 and word == bitmap.FULL:
+                if runStart != -1:
+                    yield (runStart, num - runStart)
+                    runStart = -1
+                m = bitmap.NOT_FULL.search(self.raw, 8 * w)
+                num = (m.start() >> 3) << 6 if m else self.size
+            elif (num & 63) == 0 and word == 0:
+                if runStart == -1:
+                    runStart = num
+                m = bitmap.NOT_EMPTY.search(self.raw, 8 * w)
+                num = (m.start() >> 3) << 6 if m else self.size
+            else:
+                if (word >> (num & 63)) & 1:
+                    if runStart != -1:
+                        yield (runStart, num - runStart)
+                        runStart = -1
+                elif runStart == -1:
+                    runStart = num
+                num += 1
+        if runStart != -1:
+            yield (runStart, min(num, self.size) - runStart)
+
+    def _findRun(self, count, start, end):
+        # first run of count free bits starting in [start, end), or -1
+        if count == 1:
+            return self.findFree(start, end)
+        for runStart, length in self.freeRuns(start):
+            if runStart >= end:
+                break
+            if length >= count:
+                return runStart
         return -1
 
+    def _bestRun(self, count):
+        # smallest free run that fits (lowest address on ties), or -1
+        best, bestLen = -1, 0
+        for runStart, length in self.freeRuns(self.hint << 6):
+            if length >= count and (best == -1 or length < bestLen):
+                best, bestLen = runStart, length
+                if length == count:
+                    break
+        return best
+
+    def alloc(self, count=1):
+        # allocates count contiguous bits; returns the first one, or -1
+        if count > self.numFree:
+            return -1
+        if self.policy == 'first':
+            num = self._findRun(count, self.hint << 6, self.size)
+        elif self.policy == 'best':
+            num = self._bestRun(count)
+        else:
+            if self.policy == 'next':
+                start = self.cursor
+            else:
+                start = self.rng.randrange(self.size)
+            num = self._findRun(count, start, self.size)
+            if num == -1:
+                num = self._findRun(count, 0, start)
+        if num == -1:
+            return -1
+        self._set(num, count)
+        if self.policy == 'first' and count == 1:
+            self.hint = num >> 6
+        self.cursor = (num + count) % self.size
+        return num
+
     def free(self, num):
-        assert(self.bmap[num] == 1)
-        self.bmap[num] = 0
+        assert(self.isAllocated(num))
+        if self.dev is not None:
+            self.dev.bits(self.region, num, num, True)
+        self.words[num >> 6] &= ~(1 << (num & 63)) & bitmap.FULL
+        self.numFree += 1
+        if self.touched is not None:
+            self.touched.setdefault(num, 1)
+        if (num >> 6) < self.hint:
+            self.hint = num >> 6
 
     def markAllocated(self, num):
-        self.bmap[num] = 1
+        if not self.isAllocated(num):
+            self._set(num, 1)
+
+    def allocated(self):
+        # yields every set bit in order, skipping empty words
+        words = self.words
+        w = 0
+        while True:
+            m = bitmap.NOT_EMPTY.search(self.raw, 8 * w)
+            if m is None:
+                return
+            w = m.start() >> 3
+            word = words[w]
+            while word:
+                low = word & -word
+                num = (w << 6) + low.bit_length() - 1
+                if num >= self.size:
+                    return
+                yield num
+                word ^= low
+            w += 1
 
     def dump(self):
-        s = ""
-        for i in range(len(self.bmap)):
-            s += str(self.bmap[i])
-        return s
+        bits = ''.join([format(w, '064b')[::-1] for w in self.words])
+        return bits[:self.size]
 
 class block:
+    __slots__ = ('ftype', 'dirUsed', 'dirList', 'data')
+    maxDirSize = 10
+
     def __init__(self, ftype):
         assert(ftype == 'd' or ftype == 'f' or ftype == 'free')
         self.ftype = ftype
         # only for directories, properly a list of (name, inum) tuples
         self.dirUsed = 0
-        self.maxDirSize = 10
         self.dirList = []
         # only for files, a string
         self.data = ""
@@ -47,14 +227,8 @@ class block:
         if self.ftype == 'free':
             return "[]"
         elif self.ftype == 'd':
-            rc = ""
-            for d in self.dirList:
-                # d is (name, inum)
-                short_name = d[0]
-                if len(short_name) > 10:
-                    short_name = short_name[0:10]
-                rc += " (" + short_name + "," + str(d[1]) + ")"
-            return "[" + rc + "]"
+            # (name, inum) pairs, names cut to 10 characters
+            return "[" + "".join([f" ({name[:10]},{inum})" for name, inum in self.dirList]) + "]"
         else:
             return "[" + self.data + "]"
 
@@ -116,93 +290,547 @@ class block:
         self.data = ""
         return 0
 
+class dirIndex:
+    # In-memory index of one directory. The entries themselves live in the
+    # directory's data blocks (maxDirSize per block, so the dump is unchanged);
+    # this keeps name -> entries and which blocks still have room, so lookup,
+    # insert and delete never scan the directory.
+    def __init__(self, first):
+        self.first  = first       # holds . and ..
+        self.blocks = {first: -1} # all data blocks, in order -> the next one (-1: last)
+        self.prev   = {first: -1} # and -> the one before it (-1: first)
+        self.names  = {}          # name -> [(inum, block), ...], oldest first
+        self.open   = {first: 0}  # blocks with a free slot, in the order they got one
+                                  # (not chain order); dirAdd fills the oldest
+        self.count  = 0
+
+    def lookup(self, name):
+        entries = self.names.get(name)
+        if entries is None:
+            return -1
+        return entries[0][0]
+
+class dentryCache:
+    # Bounded LRU cache of (directory inum, name) -> inum, with negative
+    # entries (-1) for names known not to exist. Resolving a path goes
+    # through here first and only falls back to the directory on a miss.
+    def __init__(self, size):
+        self.size = size
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        # cached inum (maybe -1), or None on a miss
+        inum = self.cache.get(key)
+        if inum is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.cache.move_to_end(key)
+        return inum
+
+    def put(self, key, inum):
+        if self.size <= 0:
+            return
+        self.cache[key] = inum
+        self.cache.move_to_end(key)
+        if len(self.cache) > self.size:
+            self.cache.popitem(last=False)
+
+    def invalidate(self, key):
+        self.cache.pop(key, None)
+
+class blockDevice:
+    # Block numbers of the on-disk image (see imageLayout) for inode fields,
+    # bitmap bits and data blocks, so e.g. 4096 bitmap bits or 128 refCnt
+    # fields share one block. Each access is handed to access(), which the
+    # devices below define; the fs calls these through its dev hooks.
+    FIELDS = {'itype': 1, 'iaddr': 8, 'iref': 4}  # inode field -> bytes
+
+    def __init__(self, numInodes, numData):
+        layout = imageLayout(numInodes, numData)
+        self.base = {region: layout[region] for region in ('ibitmap', 'dbitmap', 'itype', 'iaddr', 'iref')}
+        self.dataBase = layout['data'] // BLOCK_SIZE
+
+    def inode(self, inum, field, write=False):
+        self.access((self.base[field] + blockDevice.FIELDS[field] * inum) // BLOCK_SIZE, write)
+
+    def bits(self, region, first, last, write=False):
+        # bits first..last of the 'ibitmap' or 'dbitmap' region
+        for blk in range((self.base[region] + (first >> 3)) // BLOCK_SIZE,
+                         (self.base[region] + (last >> 3)) // BLOCK_SIZE + 1):
+            self.access(blk, write)
+
+    def data(self, num, write=False, whole=False, owner=None):
+        # whole: the write replaces the block, so a miss need not read it;
+        # owner: see fs.dataWritten
+        self.access(self.dataBase + num, write, whole)
+
+class bufferCache(blockDevice):
+    # The file system's block device, for I/O accounting. Up to size
+    # blocks are cached, evicted by LRU or CLOCK. Writes reach the disk at
+    # once (write-through) or when a dirty block is evicted or synced
+    # (write-back).
+    POLICIES = ('lru', 'clock')
+
+    def __init__(self, numInodes, numData, size, policy='lru', writeBack=True):
+        assert(policy in bufferCache.POLICIES and size > 0)
+        super().__init__(numInodes, numData)
+        self.size = size
+        self.policy = policy
+        self.writeBack = writeBack
+        self.lru = OrderedDict()  # LRU: cached blocks, oldest first
+        self.ring = []            # CLOCK: cached blocks by slot
+        self.slot = {}            # CLOCK: block -> slot
+        self.ref = bytearray(size)
+        self.hand = 0
+        self.dirty = set()
+        self.reads = 0    # blocks read from disk
+        self.writes = 0   # blocks written to disk
+        self.hits = 0
+        self.misses = 0
+        self.flushes = 0  # dirty blocks written back (evicted or synced)
+
+    def access(self, blk, write, whole=False):
+        if blk in self.lru or blk in self.slot:
+            self.hits += 1
+            if self.policy == 'lru':
+                self.lru.move_to_end(blk)
+            else:
+                self.ref[self.slot[blk]] = 1
+        else:
+            self.misses += 1
+            if not (write and whole):
+                self.reads += 1
+            self.insert(blk)
+        if write:
+            if self.writeBack:
+                self.dirty.add(blk)
+            else:
+                self.writes += 1
+
+    def insert(self, blk):
+        if self.policy == 'lru':
+            if len(self.lru) >= self.size:
+                self.evict(self.lru.popitem(last=False)[0])
+            self.lru[blk] = None
+            return
+        if len(self.ring) < self.size:
+            self.slot[blk] = len(self.ring)
+            self.ring.append(blk)
+            self.ref[self.slot[blk]] = 1
+            return
+        # CLOCK: clear reference bits until one is already clear
+        while self.ref[self.hand]:
+            self.ref[self.hand] = 0
+            self.hand = (self.hand + 1) % self.size
+        victim = self.ring[self.hand]
+        del self.slot[victim]
+        self.evict(victim)
+        self.ring[self.hand] = blk
+        self.slot[blk] = self.hand
+        self.ref[self.hand] = 1
+        self.hand = (self.hand + 1) % self.size
+
+    def evict(self, blk):
+        if blk in self.dirty:
+            self.dirty.discard(blk)
+            self.writes += 1
+            self.flushes += 1
+
+    def sync(self):
+        # writes back every dirty block
+        self.writes += len(self.dirty)
+        self.flushes += len(self.dirty)
+        self.dirty.clear()
+
+    def counters(self):
+        return (self.reads, self.writes, self.hits, self.misses)
+
 class inode:
-    def __init__(self, ftype='free', addr=-1, refCnt=1):
-        self.setAll(ftype, addr, refCnt)
+    # A view of one slot of an inodeTable; holds no state of its own, so
+    # fs.inodes[num] costs nothing until it is used.
+    __slots__ = ('table', 'num')
+
+    def __init__(self, table, num):
+        self.table = table
+        self.num   = num
 
     def setAll(self, ftype, addr, refCnt):
         assert(ftype == 'd' or ftype == 'f' or ftype == 'free')
-        self.ftype  = ftype
-        self.addr   = addr
-        self.refCnt = refCnt
+        if self.table.dev is not None:
+            for field in blockDevice.FIELDS:
+                self.table.dev.inode(self.num, field, True)
+        self.table.ftype[self.num]  = inodeTable.CODES[ftype]
+        self.table.addr[self.num]   = addr
+        self.table.refCnt[self.num] = refCnt
 
     def incRef(self):
-        self.refCnt += 1
+        if self.table.dev is not None:
+            self.table.dev.inode(self.num, 'iref', True)
+        self.table.refCnt[self.num] += 1
 
     def decRef(self):
-        self.refCnt -= 1
+        if self.table.dev is not None:
+            self.table.dev.inode(self.num, 'iref', True)
+        self.table.refCnt[self.num] -= 1
 
     def getRef(self):
-        return self.refCnt
+        if self.table.dev is not None:
+            self.table.dev.inode(self.num, 'iref')
+        return self.table.refCnt[self.num]
 
     def setType(self, ftype):
         assert(ftype == 'd' or ftype == 'f' or ftype == 'free')
-        self.ftype = ftype
+        if self.table.dev is not None:
+            self.table.dev.inode(self.num, 'itype', True)
+        self.table.ftype[self.num] = inodeTable.CODES[ftype]
 
     def setAddr(self, block):
-        self.addr = block
+        if self.table.dev is not None:
+            self.table.dev.inode(self.num, 'iaddr', True)
+        self.table.addr[self.num] = block
 
     def getSize(self):
-        if self.addr == -1:
+        # in blocks
+        if self.table.dev is not None:
+            self.table.dev.inode(self.num, 'iaddr')
+        if self.table.addr[self.num] == -1:
             return 0
-        else:
-            return 1
+        return sum(length for _, length in self.table.extents[self.num])
+
+    def getExtents(self):
+        # [[first block, length], ...] in file order; empty if no data
+        if self.table.dev is not None:
+            self.table.dev.inode(self.num, 'iaddr')
+        if self.table.addr[self.num] == -1:
+            return []
+        return self.table.extents[self.num]
 
     def getAddr(self):
-        return self.addr
+        if self.table.dev is not None:
+            self.table.dev.inode(self.num, 'iaddr')
+        return self.table.addr[self.num]
 
     def getType(self):
-        return self.ftype
+        if self.table.dev is not None:
+            self.table.dev.inode(self.num, 'itype')
+        return inodeTable.TYPES[self.table.ftype[self.num]]
 
     def free(self):
-        self.ftype = 'free'
-        self.addr  = -1
-        self.refCnt = 0
+        self.setAll('free', -1, 0)
+        self.table.extents.pop(self.num, None)
+
+class inodeTable:
+    # All inodes as parallel typed arrays (struct of arrays): 13 bytes per
+    # inode instead of a Python object each. Files with data also have an
+    # extent list; addr is the first block of the first extent.
+    __slots__ = ('ftype', 'addr', 'refCnt', 'extents', 'touched', 'dev')
+    TYPES = ('free', 'd', 'f')
+    CODES = {'free': 0, 'd': 1, 'f': 2}
+
+    def __init__(self, size, ftype=None, addr=None, refCnt=None):
+        # ftype/addr/refCnt: existing arrays (e.g. memoryviews into an image)
+        if ftype is None:
+            ftype  = bytearray(size)
+            addr   = array('q', [-1]) * size
+            refCnt = array('i', [0]) * size
+        self.ftype  = ftype                    # index into TYPES
+        self.addr   = addr                     # data block, -1 if none
+        self.refCnt = refCnt
+        self.extents = {}                      # inum -> [[start, length], ...]
+        self.touched = None                    # inum -> dump before first use (see fs.trackChanges)
+        self.dev = None                        # blockDevice counting field accesses, if any
+
+    def __len__(self):
+        return len(self.ftype)
+
+    def __getitem__(self, num):
+        if not 0 <= num < len(self.ftype):
+            raise IndexError(num)
+        if self.touched is not None and num not in self.touched:
+            self.touched[num] = self.dump(num)
+        return inode(self, num)
+
+    def dump(self, num):
+        ftype = inodeTable.TYPES[self.ftype[num]]
+        if ftype == 'free':
+            return '[]'
+        return f'[{ftype} a:{self.addr[num]} r:{self.refCnt[num]}]'
+
+class blockTable:
+    # Data blocks, created the first time they are used and dropped when
+    # freed; an untouched block is simply absent. With an image, a block is
+    # decoded from it the first time it is used.
+    __slots__ = ('size', 'blocks', 'image', 'touched')
+
+    def __init__(self, size, image=None):
+        self.size   = size
+        self.blocks = {}
+        self.image  = image
+        self.touched = None  # block -> dump before first use (see fs.trackChanges)
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, num):
+        b = self.blocks.get(num)
+        if b is None:
+            if not 0 <= num < self.size:
+                raise IndexError(num)
+            b = self.blocks[num] = block('free')
+            if self.image is not None:
+                self.image.readBlock(num, b)
+        if self.touched is not None and num not in self.touched:
+            self.touched[num] = b.dump()
+        return b
+
+    def dump(self, num):
+        # like self[num].dump(), without keeping an untouched block around
+        b = self.blocks.get(num)
+        if b is None:
+            if self.image is None:
+                return '[]'
+            b = block('free')
+            self.image.readBlock(num, b)
+        return b.dump()
+
+    def peek(self, num):
+        # the block if it exists, without creating it
+        return self.blocks.get(num)
+
+    def release(self, num):
+        b = self.blocks.get(num)
+        if b is not None and b.ftype == 'free':
+            del self.blocks[num]
+            if self.image is not None:
+                # or the stale image copy would be decoded again
+                self.image.clearBlock(num)
+
+class lazyDict(dict):
+    # dict whose missing keys are filled in by loader(key) (None: KeyError)
+    def __init__(self, loader=None):
+        super().__init__()
+        self.loader = loader
+
+    def __missing__(self, key):
+        if self.loader is None:
+            raise KeyError(key)
+        value = self[key] = self.loader(key)
+        return value
+
+class pathList:
+    # The op generator's list of paths. Behaves like a plain list for
+    # append, remove (first occurrence), len, in and indexing, so
+    # random.choice picks exactly what it would from a list, but remove
+    # and indexing are O(log n): removed slots are only marked dead, and a
+    # Fenwick tree counting live slots finds the k-th live one.
+    def __init__(self, paths=()):
+        self.slots = []   # path, or None once removed
+        self.where = {}   # path -> its live slots, oldest first
+        self.tree  = [0]  # Fenwick tree (1-based) of live slots
+        self.live  = 0
+        for path in paths:
+            self.append(path)
+
+    def __len__(self):
+        return self.live
+
+    def __contains__(self, path):
+        return path in self.where
+
+    def __iter__(self):
+        return (path for path in self.slots if path is not None)
+
+    def __getitem__(self, k):
+        if not 0 <= k < self.live:
+            raise IndexError(k)
+        # descend to the slot with exactly k live slots before it
+        tree, pos = self.tree, 0
+        step = 1 << (len(self.slots).bit_length() - 1)
+        while step:
+            if pos + step < len(tree) and tree[pos + step] <= k:
+                pos += step
+                k -= tree[pos]
+            step >>= 1
+        return self.slots[pos]
+
+    def append(self, path):
+        self.slots.append(path)
+        self.where.setdefault(path, []).append(len(self.slots) - 1)
+        # node i covers slots (i - lowbit(i), i]: the new one plus the
+        # sum of the nodes below it
+        i = len(self.slots)
+        count, j, low = 1, i - 1, i - (i & -i)
+        while j > low:
+            count += self.tree[j]
+            j -= j & -j
+        self.tree.append(count)
+        self.live += 1
+
+    def remove(self, path):
+        slots = self.where.get(path)
+        if slots is None:
+            raise ValueError(f'{path!r} not in list')
+        slot = slots.pop(0)
+        if not slots:
+            del self.where[path]
+        self.slots[slot] = None
+        self.live -= 1
+        i = slot + 1
+        while i < len(self.tree):
+            self.tree[i] -= 1
+            i += i & -i
+        if len(self.slots) > 1024 and self.live < len(self.slots) // 2:
+            self.__init__([p for p in self.slots if p is not None])
 
 class fs:
-    def __init__(self, numInodes, numData):
+    def __init__(self, numInodes, numData, allocPolicy='first', allocSeed=0, nested=False, dcacheSize=1024, appendWrites=False, image=None):
+        # image: open this on-disk image (see diskImage) instead of making
+        # an empty file system; numInodes and numData then come from it
+        # after a crash, the committed groups in the image's journal are
+        # redone before it is mapped; replayed counts them
+        self.replayed = replayJournal(image) if image is not None else 0
+        self.image = diskImage(image) if image is not None else None
+        if self.image is not None:
+            numInodes, numData = self.image.numInodes, self.image.numData
         self.numInodes = numInodes
         self.numData   = numData
-        
-        self.ibitmap = bitmap(self.numInodes)
-        self.inodes  = []
-        for i in range(self.numInodes):
-            self.inodes.append(inode())
-
-        self.dbitmap = bitmap(self.numData)
-        self.data    = []
-        for i in range(self.numData):
-            self.data.append(block('free'))
-
-        # root inode
-        self.ibitmap.markAllocated(0)
-        self.inodes[0].setAll('d', 0, 2)
-        self.dbitmap.markAllocated(0)
-        self.data[0].setType('d')
-        self.data[0].addEntry('.', 0)
-        self.data[0].addEntry('..', 0)
-
-        self.files = [] # list of filenames
+
+        # the allocator has its own generator so the op stream stays the
+        # same whichever policy is chosen
+        allocRng = random.Random(allocSeed)
+        self.dcache = dentryCache(dcacheSize)
+        # block device hooks: a bufferCache for I/O accounting and/or a
+        # metaJournal (see useBufferCache, useJournal)
+        self.dev = None
+        self.bcache = None
+        self.journal = None
+        if self.image is not None:
+            img = self.image
+            self.ibitmap = bitmap(self.numInodes, allocPolicy, allocRng, img.ibitmap, img.ifree)
+            self.inodes  = inodeTable(self.numInodes, img.itype, img.iaddr, img.iref)
+            self.dbitmap = bitmap(self.numData, allocPolicy, allocRng, img.dbitmap, img.dfree)
+            self.data    = blockTable(self.numData, img)
+            # directories and extent lists are read from the image on first use
+            self.dirs = lazyDict(self.loadDir)
+            self.inodes.extents = lazyDict(self.loadExtents)
+        else:
+            self.ibitmap = bitmap(self.numInodes, allocPolicy, allocRng)
+            self.inodes  = inodeTable(self.numInodes)
+
+            self.dbitmap = bitmap(self.numData, allocPolicy, allocRng)
+            self.data    = blockTable(self.numData)
+
+            # root inode
+            self.ibitmap.markAllocated(0)
+            self.inodes[0].setAll('d', 0, 2)
+            self.dbitmap.markAllocated(0)
+            self.data[0].setType('d')
+            self.dirs = lazyDict() # directory inum -> dirIndex
+            self.dirs[0] = dirIndex(0)
+            self.dirAdd(0, '.', 0)
+            self.dirAdd(0, '..', 0)
+
+        self.files = pathList() # paths (without the leading /)
+        # with nested, new files and directories go into a random existing
+        # directory instead of always the root
+        self.nested = nested
+        self.dirPaths = pathList(['']) # directories that can take new entries; '' is the root
+        # generated writes append a block instead of rewriting the only one
+        self.appendWrites = appendWrites
+        # failed unlinks explain why (off for quiet runs)
+        self.verbose = True
 
     def dump(self):
         print('inode bitmap ', self.ibitmap.dump())
-        print('inodes       ', end='')
-        for i in range(0,self.numInodes):
-            ftype = self.inodes[i].getType()
-            if ftype == 'free':
-                print('[]', end='')
-            else:
-                print(f'[{ftype} a:{self.inodes[i].getAddr()} r:{self.inodes[i].getRef()}]', end='')
-        print('')
+        print('inodes       ' + ''.join([self.inodes.dump(i) for i in range(self.numInodes)]))
         print('data bitmap  ', self.dbitmap.dump())
-        print('data         ', end='')
-        for i in range(self.numData):
-            print(self.data[i].dump(), end='')
-        print('')
+        print('data         ' + ''.join([self.data.dump(i) for i in range(self.numData)]))
+
+    def useDevice(self, dev):
+        # routes the inode, bitmap and data block hooks to dev
+        self.dev = dev
+        self.ibitmap.dev, self.ibitmap.region = dev, 'ibitmap'
+        self.dbitmap.dev, self.dbitmap.region = dev, 'dbitmap'
+        self.inodes.dev = dev
+
+    def useBufferCache(self, size, policy='lru', writeBack=True):
+        # From now on count every block access through a bufferCache
+        self.bcache = bufferCache(self.numInodes, self.numData, size, policy, writeBack)
+        if self.journal is not None:
+            self.journal.cache = self.bcache
+        else:
+            self.useDevice(self.bcache)
+
+    def useJournal(self, group=1, maxBytes=None):
+        # From now on every op is a journal transaction (needs an image)
+        self.journal = metaJournal(self, group, self.bcache, maxBytes)
+        self.useDevice(self.journal)
+
+    def printJournal(self):
+        st = self.journal.stats()
+        print(f'journal (group commit {self.journal.group}): {st["transactions"]} transactions in '
+              f'{st["commits"]} commits ({st["commits/sec"]:.0f} commits/sec), '
+              f'{st["journal bytes"]} bytes journaled, {st["checkpoint bytes"]} checkpointed, '
+              f'write amplification {st["write amplification"]:.2f}')
+
+    def printIO(self, perOp):
+        # perOp: {kind: [ops, reads, writes, hits, misses]} from run
+        dev = self.bcache
+        mode = 'write-back' if dev.writeBack else 'write-through'
+        accesses = dev.hits + dev.misses
+        print(f'buffer cache ({dev.policy}, {mode}, {dev.size} blocks): {dev.hits} hits, {dev.misses} misses, '
+              f'hit rate {dev.hits / max(1, accesses) * 100:.1f}%')
+        print(f'block I/O: {dev.reads} reads, {dev.writes} writes, {dev.flushes} dirty blocks flushed')
+        for kind, (ops, reads, writes, hits, misses) in perOp.items():
+            if ops:
+                print(f'  {kind:7} {ops:10} ops  {reads / ops:6.2f} reads/op  {writes / ops:6.2f} writes/op  '
+                      f'hit rate {hits / max(1, hits + misses) * 100:5.1f}%')
+
+    def trackChanges(self):
+        # From now on the bitmaps and tables remember the old value of
+        # everything touched, so dumpChanges costs O(touched), not O(size)
+        self.ibitmap.touched = {}
+        self.dbitmap.touched = {}
+        self.inodes.touched = {}
+        self.data.touched = {}
+
+    def dumpChanges(self):
+        # like dump, but only the entries (num:value) changed since the
+        # last dumpChanges (or trackChanges)
+        def changed(touched, current):
+            out = []
+            for num, old in sorted(touched.items()):
+                now = current(num)
+                if now != old:
+                    out.append(f'{num}:{now}')
+            touched.clear()
+            return ' '.join(out)
+        print('inode bitmap ', changed(self.ibitmap.touched, lambda n: (self.ibitmap.words[n >> 6] >> (n & 63)) & 1))
+        print('inodes       ', changed(self.inodes.touched, self.inodes.dump))
+        print('data bitmap  ', changed(self.dbitmap.touched, lambda n: (self.dbitmap.words[n >> 6] >> (n & 63)) & 1))
+        print('data         ', changed(self.data.touched, self.data.dump))
+
+    NAMES = ['a', 'b', 'c', 'd', 'e', 'f', 'g', 'h', 'j', 'k', 'm', 'n', 'o', 'p', 'q', 'r', 's', 't', 'u', 'v', 'w', 'x', 'y', 'z']
 
     def makeName(self):
-        p = ['a', 'b', 'c', 'd', 'e', 'f', 'g', 'h', 'j', 'k', 'm', 'n', 'o', 'p', 'q', 'r', 's', 't', 'u', 'v', 'w', 'x', 'y', 'z']
-        return random.choice(p)
+        return random.choice(fs.NAMES)
+
+    def makePath(self):
+        # a new path: a random name, in a random directory when nested
+        if not self.nested:
+            return self.makeName()
+        d = random.choice(self.dirPaths)
+        return d + '/' + self.makeName() if d else self.makeName()
+
+    def dropDirPath(self, path):
+        # after an unlink: path no longer names a directory to create in
+        if path in self.dirPaths:
+            inum = self.namei(path)
+            if inum == -1 or self.inodes[inum].getType() != 'd':
+                self.dirPaths.remove(path)
 
     def inodeAlloc(self):
         return self.ibitmap.alloc()
@@ -216,206 +844,1122 @@ class fs:
 
     def dataFree(self, num):
         self.dbitmap.free(num)
+        self.dataWritten(num, None, True)
         self.data[num].free()
-
-    def getParent(self, name):
-        # assumes only one level of directory
-        # thus, all files/directories are in root directory
+        self.data.release(num)
+
+    def dataWritten(self, dblock, owner, whole=False):
+        # tells the block device that data block dblock is written; owner
+        # is ('d' or 'f', inum) (its chain, for fs.blockImage), or None when
+        # the block is being freed
+        if self.dev is not None:
+            self.dev.data(dblock, True, whole, owner)
+
+    def dirLookup(self, dinum, name):
+        # inum of name in directory dinum, or -1
+        d = self.dirs[dinum]
+        if self.dev is not None:
+            # the index points at the one block holding the name; a
+            # missing name costs a read of the first block
+            entries = d.names.get(name)
+            self.dev.data(entries[0][1] if entries else d.first)
+        return d.lookup(name)
+
+    def dirAdd(self, dinum, name, inum):
+        # adds an entry, growing the directory by a data block if all are full
+        d = self.dirs[dinum]
+        self.dcache.invalidate((dinum, name))
+        if not d.open:
+            dblock = self.dataAlloc()
+            if dblock == -1:
+                return -1
+            self.data[dblock].setType('d')
+            self.dataWritten(dblock, ('d', dinum), True)
+            # chained after the last block, whose header changes too
+            last = next(reversed(d.blocks))
+            d.blocks[last] = dblock
+            d.blocks[dblock] = -1
+            d.prev[dblock] = last
+            self.dataWritten(last, ('d', dinum))
+            d.open[dblock] = 0
+        dblock = next(iter(d.open))
+        self.dataWritten(dblock, ('d', dinum))
+        self.data[dblock].addEntry(name, inum)
+        if self.data[dblock].getFreeEntry() == -1:
+            del d.open[dblock]
+        d.names.setdefault(name, []).append((inum, dblock))
+        d.count += 1
         return 0
 
+    def dirRemove(self, dinum, name):
+        # removes the oldest entry called name; returns its inum, or -1
+        d = self.dirs[dinum]
+        entries = d.names.get(name)
+        if entries is None:
+            return -1
+        self.dcache.invalidate((dinum, name))
+        inum, dblock = entries.pop(0)
+        if not entries:
+            del d.names[name]
+        self.dataWritten(dblock, ('d', dinum))
+        assert(self.data[dblock].delEntry(name) == inum)
+        d.count -= 1
+        if self.data[dblock].getNumEntries() == 0 and dblock != d.first:
+            # an emptied extra block goes back to the free pool, and the
+            # block before it in the chain now points past it
+            prev, after = d.prev.pop(dblock), d.blocks.pop(dblock)
+            d.blocks[prev] = after
+            if after != -1:
+                d.prev[after] = prev
+            self.dataWritten(prev, ('d', dinum))
+            d.open.pop(dblock, None)
+            self.dataFree(dblock)
+        else:
+            d.open[dblock] = 0
+        return inum
+
+    def lookup(self, dinum, name):
+        # one path component, through the dentry cache
+        key = (dinum, name)
+        inum = self.dcache.get(key)
+        if inum is None:
+            inum = self.dirLookup(dinum, name)
+            self.dcache.put(key, inum)
+        return inum
+
+    def splitPath(self, path):
+        # '/a/b/c' or 'a/b/c' -> ['a', 'b'], 'c'; paths start at the root
+        parts = [p for p in path.split('/') if p]
+        if not parts:
+            return [], '.'
+        return parts[:-1], parts[-1]
+
+    def getParent(self, path):
+        # inum of the directory that holds path's last component, or -1
+        dirs, _ = self.splitPath(path)
+        inum = 0
+        for name in dirs:
+            inum = self.lookup(inum, name)
+            if inum == -1 or self.inodes[inum].getType() != 'd':
+                return -1
+        return inum
+
+    def namei(self, path):
+        # inum of path, or -1
+        parentInum = self.getParent(path)
+        if parentInum == -1:
+            return -1
+        return self.lookup(parentInum, self.splitPath(path)[1])
+
     def deleteFile(self, tfile):
         # 1. Look up file in parent directory
         # 2. Free inode
-        # 3. Free data block (if any)
+        # 3. Free data block(s) (if any)
         # 4. Remove from parent directory
-        
+
         parentInum = self.getParent(tfile)
-        parentDataBlock = self.inodes[parentInum].getAddr()
-        
-        # Does file exist in parent?
-        if not self.data[parentDataBlock].entryExists(tfile):
-            print(f'Error: cannot delete file {tfile} (does not exist)')
+        name = self.splitPath(tfile)[1]
+        inum = self.lookup(parentInum, name) if parentInum != -1 else -1
+        if inum == -1 or name in ('.', '..'):
+            if self.verbose:
+                print(f'Error: cannot delete file {tfile} (does not exist)')
             return -1
 
-        # Find inumber
-        inum = self.data[parentDataBlock].delEntry(tfile)
-        
-        # Check reference count
-        if self.inodes[inum].getType() == 'd':
-            # special case: cannot delete directory if it is not empty
-            # BUT: in this simple FS, we only have one level, so only check . and ..
-            dblock = self.inodes[inum].getAddr()
-            if self.data[dblock].getNumEntries() > 2:
+        # special case: cannot delete directory if it is not empty (only . and ..)
+        if self.inodes[inum].getType() == 'd' and self.dirs[inum].count > 2:
+            if self.verbose:
                 print(f'Error: cannot delete directory {tfile} (not empty)')
-                # Add entry back to parent (undo)
-                self.data[parentDataBlock].addEntry(tfile, inum)
-                return -1
+            return -1
+
+        self.dirRemove(parentInum, name)
 
         # Decrement ref count
         self.inodes[inum].decRef()
         if self.inodes[inum].getRef() == 0:
-            # Free data block if allocated
-            dblock = self.inodes[inum].getAddr()
-            if dblock != -1:
-                self.dataFree(dblock)
+            # Free data blocks if allocated
+            if self.inodes[inum].getType() == 'd':
+                for dblock in self.dirs.pop(inum).blocks:
+                    self.dataFree(dblock)
+                # the inum may come back as another directory
+                self.dcache.invalidate((inum, '.'))
+                self.dcache.invalidate((inum, '..'))
+            else:
+                for start, length in self.inodes[inum].getExtents():
+                    for dblock in range(start, start + length):
+                        self.dataFree(dblock)
             # Free inode
             self.inodeFree(inum)
         return 0
 
     def createLink(self, target, newfile, parent):
         # 1. Lookup target file
-        parentInum = self.getParent(target)
-        parentDataBlock = self.inodes[parentInum].getAddr()
-        if not self.data[parentDataBlock].entryExists(target):
-            # print('Error: cannot link to file (does not exist)')
+        targetInum = self.namei(target)
+        if targetInum == -1:
             return -1
-        
-        # Find inumber of target
-        # (This is inefficient, but simple)
-        # In real FS, we would just do a lookup
-        # Here we have to search the parent directory list
-        # Since we just checked existence, we know it is there.
-        # But wait, entryExists doesn't return inum.
-        # So we have to do it again or scan manually.
-        # Actually, let's just cheat and scan.
-        targetInum = -1
-        for i in range(self.data[parentDataBlock].getNumEntries()):
-             e = self.data[parentDataBlock].getEntry(i)
-             if e[0] == target:
-                 targetInum = e[1]
-                 break
-        
+
         if self.inodes[targetInum].getType() == 'd':
             # cannot hard link to directory
             return -1
 
-        # 2. Check if newfile already exists
-        if self.data[parentDataBlock].entryExists(newfile):
+        # 2. Check if newfile already exists (its directory must)
+        parentInum = self.getParent(newfile)
+        if parentInum == -1:
+            return -1
+        name = self.splitPath(newfile)[1]
+        if self.lookup(parentInum, name) != -1:
             return -1
 
-        # 3. Increment ref count of target inode
+        # 3. Add entry to parent directory, 4. increment ref count of target inode
+        if self.dirAdd(parentInum, name, targetInum) == -1:
+            return -1
         self.inodes[targetInum].incRef()
-
-        # 4. Add entry to parent directory
-        self.data[parentDataBlock].addEntry(newfile, targetInum)
         return 0
 
     def createFile(self, parent, newfile, ftype):
+        # parent is the directory's inum, newfile a single name in it
+        if parent == -1:
+            return -1
+
+        # Everything the op needs is checked first: a directory needs a
+        # block, and so does the parent if all of its blocks are full. So
+        # it either changes nothing or completes, as one transaction.
+        needed = (1 if ftype == 'd' else 0) + (0 if self.dirs[parent].open else 1)
+        if self.ibitmap.numFree == 0 or needed > self.dbitmap.numFree:
+            return -1
+
         # 1. Allocate inode
         inum = self.inodeAlloc()
-        if inum == -1:
-            return -1
-        
+
         # 2. If directory, allocate data block
         dblock = -1
         if ftype == 'd':
             dblock = self.dataAlloc()
-            if dblock == -1:
-                self.inodeFree(inum)
-                return -1
             self.data[dblock].setType('d')
-            self.data[dblock].addEntry('.', inum)
-            self.data[dblock].addEntry('..', parent)
-        
+            self.dataWritten(dblock, ('d', inum), True)
+            self.dirs[inum] = dirIndex(dblock)
+            self.dirAdd(inum, '.', inum)
+            self.dirAdd(inum, '..', parent)
+
         # 3. Update inode
         self.inodes[inum].setAll(ftype, dblock, 1)
 
-        # 4. Add to parent directory
-        parentDataBlock = self.inodes[parent].getAddr()
-        if self.data[parentDataBlock].getFreeEntry() == -1:
-            # Parent directory full
-            self.inodeFree(inum)
-            if dblock != -1:
-                self.dataFree(dblock)
-            return -1
-            
-        self.data[parentDataBlock].addEntry(newfile, inum)
+        # 4. Add to parent directory (grows it if every block is full)
+        assert(self.dirAdd(parent, newfile, inum) == 0)
         return 0
 
-    def writeFile(self, tfile, data):
-        parentInum = self.getParent(tfile)
-        parentDataBlock = self.inodes[parentInum].getAddr()
-        
-        if not self.data[parentDataBlock].entryExists(tfile):
+    def appendBlocks(self, inum, count):
+        # Adds count blocks to the end of a file: first by growing its last
+        # extent in place, then as contiguous as the allocator allows.
+        # Returns the new blocks, or -1 (and allocates nothing) if there is
+        # not enough free space.
+        if count > self.dbitmap.numFree:
             return -1
-        
-        # Find inum
-        targetInum = -1
-        for i in range(self.data[parentDataBlock].getNumEntries()):
-             e = self.data[parentDataBlock].getEntry(i)
-             if e[0] == tfile:
-                 targetInum = e[1]
-                 break
-        
+        if self.inodes[inum].getAddr() == -1:
+            extents = self.inodes.extents[inum] = []
+        else:
+            extents = self.inodes.extents[inum]
+        added = []
+        if extents:
+            # the current last block will point at the first new one
+            last = extents[-1]
+            self.dataWritten(last[0] + last[1] - 1, ('f', inum))
+            while count > 0 and last[0] + last[1] < self.numData and \
+                  not self.dbitmap.isAllocated(last[0] + last[1]):
+                self.dbitmap.markAllocated(last[0] + last[1])
+                added.append(last[0] + last[1])
+                last[1] += 1
+                count -= 1
+        while count > 0:
+            # largest run we can get, halving the request when none fits
+            want = count
+            start = self.dbitmap.alloc(want)
+            while start == -1:
+                want = (want + 1) // 2
+                start = self.dbitmap.alloc(want)
+            extents.append([start, want])
+            added.extend(range(start, start + want))
+            count -= want
+        for dblock in added:
+            self.data[dblock].setType('f')
+        self.inodes[inum].setAddr(extents[0][0])
+        return added
+
+    def writeFile(self, tfile, data, append=False, count=1):
+        # Without append a file keeps at most one block and a write replaces
+        # its contents (the classic vsfs behaviour); with append every write
+        # adds count blocks holding data.
+        targetInum = self.namei(tfile)
+        if targetInum == -1:
+            return -1
+
         if self.inodes[targetInum].getType() == 'd':
             return -1
 
+        if append:
+            added = self.appendBlocks(targetInum, count)
+            if added == -1:
+                return -1
+            for dblock in added:
+                self.dataWritten(dblock, ('f', targetInum), True)
+                self.data[dblock].addData(data)
+            return 0
+
         # Check if data block already allocated
         dblock = self.inodes[targetInum].getAddr()
         if dblock == -1:
-            dblock = self.dataAlloc()
-            if dblock == -1:
+            added = self.appendBlocks(targetInum, 1)
+            if added == -1:
                 return -1
-            self.inodes[targetInum].setAddr(dblock)
-            self.data[dblock].setType('f')
+            dblock = added[0]
 
+        self.dataWritten(dblock, ('f', targetInum), True)
         self.data[dblock].addData(data)
         return 0
 
-    def run(self, numRequests):
-        # initial state
-        self.dump()
-        for i in range(numRequests):
-            # random decision
+    def layout(self):
+        # (per-file [(inum, blocks, extents)], free-space summary)
+        files = []
+        for inum in self.ibitmap.allocated():
+            if self.inodes[inum].getType() == 'f' and self.inodes[inum].getAddr() != -1:
+                extents = self.inodes[inum].getExtents()
+                files.append((inum, sum(length for _, length in extents), len(extents)))
+        runs = [length for _, length in self.dbitmap.freeRuns()]
+        free = sum(runs)
+        largest = max(runs) if runs else 0
+        summary = {
+            'free': free,
+            'runs': len(runs),
+            'largest': largest,
+            # share of free space outside the largest free run
+            'fragmentation': 1 - largest / free if free else 0.0,
+        }
+        return files, summary
+
+    def printLayout(self):
+        files, summary = self.layout()
+        print('file layout (inum blocks extents):', ' '.join(f'{i}:{b}:{e}' for i, b, e in files))
+        if files:
+            extents = [e for _, _, e in files]
+            print(f'extents per file: avg {sum(extents) / len(extents):.2f}, max {max(extents)}')
+        print(f'free space: {summary["free"]} blocks in {summary["runs"]} runs, '
+              f'largest {summary["largest"]}, fragmentation {summary["fragmentation"]:.2f}')
+
+    def loadDir(self, inum):
+        # dirIndex of a directory stored in the image, by walking its blocks
+        first = self.inodes[inum].getAddr()
+        d = dirIndex(first)
+        d.open = {}
+        prev = None
+        for dblock in self.image.chain(first):
+            blk = self.data[dblock]
+            d.blocks[dblock] = -1
+            d.prev[dblock] = -1 if prev is None else prev
+            if prev is not None:
+                d.blocks[prev] = dblock
+            prev = dblock
+            for name, entry in blk.dirList:
+                d.names.setdefault(name, []).append((entry, dblock))
+                d.count += 1
+            if blk.getFreeEntry() != -1:
+                d.open[dblock] = 0
+        return d
+
+    def loadExtents(self, inum):
+        # extent list of a file stored in the image
+        extents = []
+        for dblock in self.image.chain(self.inodes[inum].getAddr()):
+            if extents and extents[-1][0] + extents[-1][1] == dblock:
+                extents[-1][1] += 1
+            else:
+                extents.append([dblock, 1])
+        return extents
+
+    def chainNext(self, dblock, owner):
+        # block after dblock in the chain of owner ('d' or 'f', inum), or -1
+        kind, inum = owner
+        if kind == 'd':
+            return self.dirs[inum].blocks[dblock]
+        extents = self.inodes.extents[inum]
+        # written blocks are nearly always at the end of the file
+        for i in range(len(extents) - 1, -1, -1):
+            start, length = extents[i]
+            if start <= dblock < start + length:
+                if dblock + 1 < start + length:
+                    return dblock + 1
+                return extents[i + 1][0] if i + 1 < len(extents) else -1
+        return -1
+
+    def blockImage(self, blk, owner=None):
+        # the BLOCK_SIZE bytes image block blk holds in the current state
+        # (as save would write them); for a data block, owner is as in
+        # dataWritten
+        layout = imageLayout(self.numInodes, self.numData)
+        if blk == 0:
+            return SUPERBLOCK.pack(IMAGE_MAGIC, IMAGE_VERSION, BLOCK_SIZE, self.numInodes, self.numData,
+                                   layout['ibitmap'], layout['dbitmap'], layout['itype'], layout['iaddr'],
+                                   layout['iref'], layout['data'], self.ibitmap.numFree,
+                                   self.dbitmap.numFree).ljust(BLOCK_SIZE, b'\0')
+        offset = blk * BLOCK_SIZE
+        if offset >= layout['data']:
+            if owner is None:
+                return bytes(BLOCK_SIZE)
+            dblock = blk - layout['data'] // BLOCK_SIZE
+            nextBlock = self.chainNext(dblock, owner)
+            b = self.data.peek(dblock)
+            if b is None and self.image is not None:
+                # never loaded: as in the image, but for its chain pointer
+                raw = bytearray(self.image.rawBlock(dblock))
+                code, count, _ = BLOCK_HEADER.unpack_from(raw)
+                BLOCK_HEADER.pack_into(raw, 0, code, count, nextBlock)
+                return bytes(raw)
+            return bytes(encodeBlock(b if b is not None else block('free'), nextBlock))
+        for region, view in (('ibitmap', self.ibitmap.raw), ('dbitmap', self.dbitmap.raw),
+                             ('itype', memoryview(self.inodes.ftype).cast('B')),
+                             ('iaddr', memoryview(self.inodes.addr).cast('B')),
+                             ('iref', memoryview(self.inodes.refCnt).cast('B'))):
+            start = offset - layout[region]
+            if 0 <= start < len(view):
+                return bytes(view[start:start + BLOCK_SIZE]).ljust(BLOCK_SIZE, b'\0')
+        return bytes(BLOCK_SIZE)
+
+    def scanNames(self):
+        # rebuilds files/dirPaths (the op generator's view) from the tree
+        self.files = pathList()
+        self.dirPaths = pathList([''])
+        todo = [('', 0)]
+        while todo:
+            path, dinum = todo.pop()
+            for name, entries in list(self.dirs[dinum].names.items()):
+                if name in ('.', '..'):
+                    continue
+                child = path + '/' + name if path else name
+                for inum, _ in entries:
+                    self.files.append(child)
+                    if self.inodes[inum].getType() == 'd':
+                        self.dirPaths.append(child)
+                        todo.append((child, inum))
+
+    def save(self, path):
+        # Writes the whole file system as an image (see imageLayout). Free
+        # data blocks are never written, so the file is sparse. Written to
+        # a temporary file first: path may be the image this fs came from.
+        layout = imageLayout(self.numInodes, self.numData)
+        # block -> next block of the same file/directory, for everything
+        # held in memory; blocks of untouched files keep their image chain
+        nextOf = {}
+        for d in dict.values(self.dirs):
+            nextOf.update(d.blocks)
+        for extents in dict.values(self.inodes.extents):
+            order = [b for start, length in extents for b in range(start, start + length)]
+            nextOf.update(zip(order, order[1:] + [-1]))
+
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.truncate(layout['size'])
+            f.write(SUPERBLOCK.pack(IMAGE_MAGIC, IMAGE_VERSION, BLOCK_SIZE, self.numInodes, self.numData,
+                                    layout['ibitmap'], layout['dbitmap'], layout['itype'], layout['iaddr'],
+                                    layout['iref'], layout['data'], self.ibitmap.numFree, self.dbitmap.numFree))
+            f.seek(layout['ibitmap'])
+            f.write(self.ibitmap.raw)
+            f.seek(layout['dbitmap'])
+            f.write(self.dbitmap.raw)
+            f.seek(layout['itype'])
+            f.write(memoryview(self.inodes.ftype).cast('B'))
+            f.seek(layout['iaddr'])
+            f.write(memoryview(self.inodes.addr).cast('B'))
+            f.seek(layout['iref'])
+            f.write(memoryview(self.inodes.refCnt).cast('B'))
+            for dblock in self.dbitmap.allocated():
+                blk = self.data.peek(dblock)
+                if blk is None and self.image is not None:
+                    raw = bytearray(self.image.rawBlock(dblock))
+                    if dblock in nextOf:
+                        code, count, _ = BLOCK_HEADER.unpack_from(raw)
+                        BLOCK_HEADER.pack_into(raw, 0, code, count, nextOf[dblock])
+                else:
+                    if blk is None:
+                        blk = block('free')
+                    default = self.image.nextBlock(dblock) if self.image is not None else -1
+                    raw = encodeBlock(blk, nextOf.get(dblock, default))
+                f.seek(layout['data'] + dblock * BLOCK_SIZE)
+                f.write(raw)
+        os.replace(tmp, path)
+
+    def genOps(self):
+        # The random workload, as op tuples: (kind, path), or ('link',
+        # target, newfile). Lazy, so each op is drawn from the state the
+        # ones before it left behind.
+        while True:
             if len(self.files) > 0:
                 op = random.random()
             else:
                 op = 0.0 # force create if empty
 
             if op < 0.5:
-                # create
-                f = self.makeName()
+                f = self.makePath()
                 # 50% chance of file or dir
-                if random.random() < 0.5:
-                    print(f'mkdir("/{f}");')
-                    if self.createFile(0, f, 'd') == -1:
-                        print('mkdir failed: No space/inodes or dir full')
-                    else:
-                        self.files.append(f)
-                else:
-                    print(f'creat("/{f}");')
-                    if self.createFile(0, f, 'f') == -1:
-                        print('creat failed: No space/inodes or dir full')
-                    else:
-                        self.files.append(f)
+                yield ('mkdir', f) if random.random() < 0.5 else ('creat', f)
             elif op < 0.7:
-                # write
-                if len(self.files) > 0:
-                    f = random.choice(self.files)
-                    print(f'fd=open("/{f}", O_WRONLY|O_APPEND); write(fd, buf, BLOCKSIZE); close(fd);')
-                    if self.writeFile(f, "a") == -1:
-                         print('write failed')
+                yield ('write', random.choice(self.files))
             elif op < 0.8:
-                # delete
-                if len(self.files) > 0:
-                    f = random.choice(self.files)
-                    print(f'unlink("/{f}");')
-                    if self.deleteFile(f) == -1:
-                        print('unlink failed')
-                    else:
-                        self.files.remove(f)
+                yield ('unlink', random.choice(self.files))
             else:
-                 # link
-                 if len(self.files) > 0:
-                     target = random.choice(self.files)
-                     newfile = self.makeName()
-                     print(f'link("/{target}", "/{newfile}");')
-                     if self.createLink(target, newfile, 0) == -1:
-                         print('link failed')
-                     else:
-                         self.files.append(newfile)
-            
+                target = random.choice(self.files)
+                yield ('link', target, self.makePath())
+
+    def apply(self, op):
+        # performs one op tuple and keeps files/dirPaths in step; 0 or -1
+        kind, path = op[0], op[1]
+        if kind == 'mkdir' or kind == 'creat':
+            ftype = 'd' if kind == 'mkdir' else 'f'
+            if self.createFile(self.getParent(path), self.splitPath(path)[1], ftype) == -1:
+                return -1
+            self.files.append(path)
+            if ftype == 'd':
+                self.dirPaths.append(path)
+        elif kind == 'write':
+            return self.writeFile(path, "a", self.appendWrites)
+        elif kind == 'unlink':
+            # files holds every name in the tree, so a path outside it
+            # (say, from a log made elsewhere) cannot be deleted
+            if path not in self.files or self.deleteFile(path) == -1:
+                return -1
+            self.files.remove(path)
+            self.dropDirPath(path)
+        else:
+            if self.createLink(path, op[2], 0) == -1:
+                return -1
+            self.files.append(op[2])
+        return 0
+
+    def run(self, numRequests, mode='state', compute=False, delta=False, ops=None, record=None):
+        # The op loop behind every mode:
+        #   'state'  prints the state after each op; the op only with compute
+        #   'ops'    prints each op; the state after it only with compute
+        #   'quiet'  prints nothing per op, then ops/sec, per-op counts and
+        #            the summary
+        #   'silent' prints nothing at all
+        # delta prints only the entries that changed instead of the whole
+        # state. ops: op tuples to run instead of the random workload (e.g.
+        # readOpLog), numRequests None runs all of them. record: write the
+        # ops run to this op log. Returns {kind: [ops, failed]}.
+        quiet = mode in ('quiet', 'silent')
+        if not quiet:
+            print("Initial state")
             self.dump()
+            print("")
+            if delta:
+                self.trackChanges()
+        else:
+            self.verbose = False
+        counts = {kind: [0, 0] for kind in OP_FORMATS}
+        perOp = {kind: [0, 0, 0, 0, 0] for kind in OP_FORMATS}  # ops, then deltas of dev.counters()
+        ops = self.genOps() if ops is None else iter(ops)
+        log = opLogWriter(record) if record else None
+        started = time.perf_counter()
+        for op in itertools.islice(ops, numRequests):
+            if log is not None:
+                log.write(op)
+            if self.bcache is not None:
+                before = self.bcache.counters()
+            failed = self.apply(op) == -1
+            if self.journal is not None:
+                self.journal.end()
+            if self.bcache is not None:
+                io = perOp[op[0]]
+                io[0] += 1
+                for k, (now, was) in enumerate(zip(self.bcache.counters(), before)):
+                    io[k + 1] += now - was
+            counts[op[0]][0] += 1
+            counts[op[0]][1] += failed
+            if quiet:
+                continue
+
+            opStr = OP_FORMATS[op[0]].format(*op[1:])
+            if failed:
+                opStr += " [failed]"
+            showState = True
+            if mode == 'ops':
+                print(opStr)
+                showState = compute
+            elif compute:
+                print(opStr)
+            else:
+                print("Which operation took place?")
+            if not showState:
+                print("  State? (Use -c to see the answer)")
+            elif delta:
+                self.dumpChanges()
+            else:
+                self.dump()
+            print("")
+        elapsed = time.perf_counter() - started
+        if log is not None:
+            log.close()
+        if self.bcache is not None:
+            self.bcache.sync()
+
+        if quiet:
+            self.verbose = True
+        if mode == 'quiet':
+            total = sum(done for done, _ in counts.values())
+            rate = total / elapsed if elapsed > 0 else 0.0
+            print(f'{total} ops in {elapsed:.2f} s ({rate:.0f} ops/sec)')
+            for kind, (done, failed) in counts.items():
+                print(f'  {kind:7} {done:10} ({failed} failed)')
+        if self.bcache is not None and mode != 'silent':
+            self.printIO(perOp)
+        if mode == 'quiet':
+            self.printSummary()
+        return counts
+
+    def summary(self):
+        # End state, in numbers that can be compared between runs of the
+        # same op stream (e.g. a replayed log under another -a or -D).
+        # digest covers the namespace only (paths, types, sizes in blocks,
+        # link counts), so it does not depend on where blocks were put.
+        entries = []
+        dirBlocks = 0
+        todo = [('', 0)]
+        while todo:
+            path, dinum = todo.pop()
+            d = self.dirs[dinum]
+            dirBlocks += len(d.blocks)
+            for name, named in d.names.items():
+                if name in ('.', '..'):
+                    continue
+                child = path + '/' + name
+                for inum, _ in named:
+                    node = self.inodes[inum]
+                    if node.getType() == 'd':
+                        size = len(self.dirs[inum].blocks)
+                        todo.append((child, inum))
+                    else:
+                        size = node.getSize()
+                    entries.append(f'{child} {node.getType()} {size} {node.getRef()}')
+        entries.sort()
+        digest = hashlib.sha1('\n'.join(entries).encode()).hexdigest()[:16]
+        files, layout = self.layout()
+        return {
+            'entries': len(entries),
+            'inodes used': self.numInodes - self.ibitmap.numFree,
+            'data used': self.numData - self.dbitmap.numFree,
+            'dir blocks': dirBlocks,
+            'extents per file': sum(e for _, _, e in files) / len(files) if files else 0.0,
+            'free runs': layout['runs'],
+            'fragmentation': layout['fragmentation'],
+            'dcache hit rate': self.dcache.hits / max(1, self.dcache.hits + self.dcache.misses),
+            'digest': digest,
+        }
+
+    def printSummary(self):
+        for key, value in self.summary().items():
+            print(f'{key + ":":18}', f'{value:.3f}' if isinstance(value, float) else value)
+
+# syscall each op tuple stands for, as printed
+OP_FORMATS = {
+    'creat':  'creat("/{0}");',
+    'mkdir':  'mkdir("/{0}");',
+    'write':  'fd=open("/{0}", O_WRONLY|O_APPEND); write(fd, buf, BLOCKSIZE); close(fd);',
+    'unlink': 'unlink("/{0}");',
+    'link':   'link("/{0}", "/{1}");',
+}
+
+# --- Op logs ---
+#
+# One op per line: a one-letter code and its absolute paths,
+#   c /a        creat          w /a     write
+#   m /a/b      mkdir          u /a     unlink
+#   l /a /b     link /a as /b
+# after a header line. Any run can be recorded (--record) and a log
+# replayed (--replay) in place of the random workload, so different
+# allocators or directory settings see exactly the same op stream.
+
+OPLOG_HEADER = '# vsfs op log 1\n'
+OPLOG_BATCH  = 1 << 16   # lines read or written at a time
+OP_CODES = {'creat': 'c', 'mkdir': 'm', 'write': 'w', 'unlink': 'u', 'link': 'l'}
+OP_KINDS = {code: kind for kind, code in OP_CODES.items()}
+
+class opLogWriter:
+    def __init__(self, path):
+        self.f = open(path, 'w')
+        self.f.write(OPLOG_HEADER)
+        self.lines = []
+
+    def write(self, op):
+        for path in op[1:]:
+            assert(not any(c.isspace() for c in path))
+        self.lines.append(OP_CODES[op[0]] + ' /' + ' /'.join(op[1:]) + '\n')
+        if len(self.lines) >= OPLOG_BATCH:
+            self.f.writelines(self.lines)
+            self.lines = []
+
+    def close(self):
+        self.f.writelines(self.lines)
+        self.f.close()
+
+def readOpLog(path, batch=OPLOG_BATCH):
+    # yields the op tuples of a log, parsing batch lines at a time
+    with open(path) as f:
+        if f.readline() != OPLOG_HEADER:
+            raise ValueError(f'{path}: not a vsfs op log')
+        lineNo = 1
+        while True:
+            lines = list(itertools.islice(f, batch))
+            if not lines:
+                return
+            ops = []
+            for line in lines:
+                lineNo += 1
+                code, *paths = line.split()
+                kind = OP_KINDS.get(code)
+                if kind is None or len(paths) != (2 if kind == 'link' else 1) or \
+                   not all(p.startswith('/') for p in paths):
+                    raise ValueError(f'{path}:{lineNo}: bad op {line.strip()!r}')
+                # same spelling as the generator's paths: no empty components
+                ops.append((kind,) + tuple('/'.join(c for c in p.split('/') if c) for p in paths))
+            yield from ops
+
+# --- On-disk image ---
+#
+# Layout (every region starts on a 4 KiB boundary, all little-endian):
+#   superblock    SUPERBLOCK: magic, version, block size, counts, region
+#                 offsets, free inode and free data block counts
+#   inode bitmap  64-bit words, as in bitmap.words
+#   data bitmap   same
+#   inode table   stored as three arrays, like inodeTable: type (1 byte),
+#                 addr (8 bytes), refCnt (4 bytes) per inode
+#   data region   BLOCK_SIZE bytes per block: BLOCK_HEADER (type, entry
+#                 count or data length, next block of the same file or
+#                 directory, -1 at the end), then DIR_ENTRY records or the
+#                 file's bytes
+# A file's or directory's blocks are a chain from its inode's addr; extent
+# lists and directory indexes are rebuilt from the chain when first used.
+
+IMAGE_MAGIC   = b'VSFSIMG\0'
+IMAGE_VERSION = 1
+BLOCK_SIZE    = 512
+IMAGE_ALIGN   = 4096
+SUPERBLOCK    = struct.Struct('<8sIIQQQQQQQQQQ')
+BLOCK_HEADER  = struct.Struct('<BxHq')
+DIR_ENTRY     = struct.Struct('<iB27s')
+MAX_NAME      = 27
+MAX_FILE_DATA = BLOCK_SIZE - BLOCK_HEADER.size
+
+def imageLayout(numInodes, numData):
+    # byte offset of every region, and the total size
+    def align(n):
+        return (n + IMAGE_ALIGN - 1) // IMAGE_ALIGN * IMAGE_ALIGN
+    layout = {}
+    pos = align(SUPERBLOCK.size)
+    for region, size in (('ibitmap', 8 * ((numInodes + 63) // 64)),
+                         ('dbitmap', 8 * ((numData + 63) // 64)),
+                         ('itype', numInodes),
+                         ('iaddr', 8 * numInodes),
+                         ('iref', 4 * numInodes),
+                         ('data', BLOCK_SIZE * numData)):
+        layout[region] = pos
+        pos = align(pos + size)
+    layout['size'] = pos
+    return layout
+
+def encodeBlock(blk, nextBlock):
+    raw = bytearray(BLOCK_SIZE)
+    if blk.ftype == 'd':
+        BLOCK_HEADER.pack_into(raw, 0, inodeTable.CODES['d'], blk.dirUsed, nextBlock)
+        for i, (name, inum) in enumerate(blk.dirList):
+            name = name.encode()
+            assert(len(name) <= MAX_NAME)
+            DIR_ENTRY.pack_into(raw, BLOCK_HEADER.size + i * DIR_ENTRY.size, inum, len(name), name)
+    elif blk.ftype == 'f':
+        data = blk.data.encode()[:MAX_FILE_DATA]
+        BLOCK_HEADER.pack_into(raw, 0, inodeTable.CODES['f'], len(data), nextBlock)
+        raw[BLOCK_HEADER.size:BLOCK_HEADER.size + len(data)] = data
+    return raw
+
+class diskImage:
+    # An image mapped with mmap (copy-on write: changes stay in this
+    # process until fs.save). The bitmaps and inode arrays are memoryviews
+    # into the mapping, so only the pages that are touched get read.
+    def __init__(self, path, writable=True):
+        assert(sys.byteorder == 'little')
+        self.path = path
+        with open(path, 'rb') as f:
+            access = mmap.ACCESS_COPY if writable else mmap.ACCESS_READ
+            self.mm = mmap.mmap(f.fileno(), 0, access=access)
+        if len(self.mm) < SUPERBLOCK.size:
+            raise ValueError(f'{path}: too short for a vsfs image')
+        (magic, version, blockSize, self.numInodes, self.numData, ib, db, it, ia, ir, dr,
+         self.ifree, self.dfree) = SUPERBLOCK.unpack_from(self.mm)
+        if magic != IMAGE_MAGIC or version != IMAGE_VERSION or blockSize != BLOCK_SIZE:
+            raise ValueError(f'{path}: not a vsfs image (or another version)')
+        layout = imageLayout(self.numInodes, self.numData)
+        if (ib, db, it, ia, ir, dr) != tuple(layout[r] for r in ('ibitmap', 'dbitmap', 'itype', 'iaddr', 'iref', 'data')) \
+           or len(self.mm) < layout['size']:
+            raise ValueError(f'{path}: bad layout in superblock')
+        view = memoryview(self.mm)
+        nwords = (self.numInodes + 63) // 64
+        self.ibitmap = view[ib:ib + 8 * nwords].cast('Q')
+        nwords = (self.numData + 63) // 64
+        self.dbitmap = view[db:db + 8 * nwords].cast('Q')
+        self.itype = view[it:it + self.numInodes]
+        self.iaddr = view[ia:ia + 8 * self.numInodes].cast('q')
+        self.iref  = view[ir:ir + 4 * self.numInodes].cast('i')
+        self.dataOffset = dr
+
+    def rawBlock(self, num):
+        start = self.dataOffset + num * BLOCK_SIZE
+        return memoryview(self.mm)[start:start + BLOCK_SIZE]
+
+    def header(self, num):
+        # (type code, count, next block)
+        return BLOCK_HEADER.unpack_from(self.mm, self.dataOffset + num * BLOCK_SIZE)
+
+    def nextBlock(self, num):
+        return self.header(num)[2]
+
+    def chain(self, first):
+        # blocks of one file or directory, in order
+        num = first
+        steps = 0
+        while num != -1:
+            if not 0 <= num < self.numData or steps > self.numData:
+                raise ValueError(f'{self.path}: broken block chain at {num}')
+            yield num
+            num = self.nextBlock(num)
+            steps += 1
+
+    def readBlock(self, num, blk):
+        # fills a fresh block object from the image
+        code, count, _ = self.header(num)
+        ftype = inodeTable.TYPES[code]
+        if ftype == 'free':
+            return
+        blk.setType(ftype)
+        start = self.dataOffset + num * BLOCK_SIZE + BLOCK_HEADER.size
+        if ftype == 'd':
+            for i in range(count):
+                inum, length, name = DIR_ENTRY.unpack_from(self.mm, start + i * DIR_ENTRY.size)
+                blk.addEntry(name[:length].decode(), inum)
+        else:
+            blk.addData(self.mm[start:start + count].decode())
+
+    def clearBlock(self, num):
+        self.mm[self.dataOffset + num * BLOCK_SIZE] = 0
+
+def fsck(path, chunk=1 << 20, maxReport=50):
+    # Checks an image without building an fs: bitmaps against inodes and
+    # block chains, refCnt against directory entries, and . / .. in every
+    # directory. Inodes are read chunk by chunk; besides the mapping it
+    # keeps one bit per data block and one counter per inode.
+    # Prints the problems found and returns how many there were.
+    img = diskImage(path, writable=False)
+    numInodes, numData = img.numInodes, img.numData
+    errors = []
+    def error(msg):
+        if len(errors) < maxReport:
+            print('fsck:', msg)
+        errors.append(msg)
+
+    def bitSet(words, num):
+        return (words[num >> 6] >> (num & 63)) & 1
+
+    seen = bytearray((numData + 7) // 8)   # data blocks reached from inodes
+    refs = array('i', [0]) * numInodes     # directory entries naming each inode
+    parentOf = {}                          # directory -> the directory naming it
+    dotdot = {}                            # directory -> its .. entry
+    usedInodes = 0
+    for base in range(0, numInodes, chunk):
+        types = bytes(img.itype[base:base + chunk])
+        addrs = img.iaddr[base:base + chunk].tolist()
+        for off, code in enumerate(types):
+            inum = base + off
+            if code == 0:
+                if bitSet(img.ibitmap, inum):
+                    error(f'inode {inum} is free but marked in the inode bitmap')
+                continue
+            usedInodes += 1
+            ftype = inodeTable.TYPES[code] if code < len(inodeTable.TYPES) else None
+            if ftype is None:
+                error(f'inode {inum} has bad type {code}')
+                continue
+            if not bitSet(img.ibitmap, inum):
+                error(f'inode {inum} is in use but free in the inode bitmap')
+            addr = addrs[off]
+            if addr == -1:
+                if ftype == 'd':
+                    error(f'directory {inum} has no data block')
+                continue
+            try:
+                blocks = list(img.chain(addr))
+            except ValueError as e:
+                error(f'inode {inum}: {e}')
+                continue
+            for dblock in blocks:
+                if seen[dblock >> 3] & (1 << (dblock & 7)):
+                    error(f'block {dblock} is used twice (again by inode {inum})')
+                seen[dblock >> 3] |= 1 << (dblock & 7)
+                if not bitSet(img.dbitmap, dblock):
+                    error(f'block {dblock} of inode {inum} is free in the data bitmap')
+                code, count, _ = img.header(dblock)
+                if code != inodeTable.CODES[ftype]:
+                    error(f'block {dblock} of inode {inum} has type {code}, not {ftype}')
+                    continue
+                if ftype != 'd':
+                    continue
+                start = img.dataOffset + dblock * BLOCK_SIZE + BLOCK_HEADER.size
+                for i in range(count):
+                    entry, length, name = DIR_ENTRY.unpack_from(img.mm, start + i * DIR_ENTRY.size)
+                    name = name[:length].decode(errors='replace')
+                    if not 0 <= entry < numInodes:
+                        error(f'directory {inum}: entry {name!r} names bad inode {entry}')
+                    elif name == '.':
+                        if entry != inum:
+                            error(f'directory {inum}: . is {entry}')
+                    elif name == '..':
+                        dotdot[inum] = entry
+                    else:
+                        refs[entry] += 1
+                        etype = img.itype[entry]
+                        if etype == 0:
+                            error(f'directory {inum}: entry {name!r} names free inode {entry}')
+                        elif etype == inodeTable.CODES['d']:
+                            if entry in parentOf:
+                                error(f'directory {entry} is in both {parentOf[entry]} and {inum}')
+                            parentOf[entry] = inum
+
+    # refCnt and .. (the root is its own parent and keeps refCnt 2)
+    for base in range(0, numInodes, chunk):
+        types = bytes(img.itype[base:base + chunk])
+        counts = img.iref[base:base + chunk].tolist()
+        for off, code in enumerate(types):
+            inum = base + off
+            if code == 0:
+                continue
+            want = 2 if inum == 0 else refs[inum]
+            if counts[off] != want:
+                error(f'inode {inum} has refCnt {counts[off]}, but {want} entries')
+            if code == inodeTable.CODES['d']:
+                parent = 0 if inum == 0 else parentOf.get(inum)
+                if parent is None:
+                    error(f'directory {inum} is not in any directory')
+                elif dotdot.get(inum) != parent:
+                    error(f'directory {inum}: .. is {dotdot.get(inum)}, not {parent}')
+            elif refs[inum] == 0:
+                error(f'file {inum} is not in any directory')
+
+    # data bitmap against the blocks reached, 8 KiB of bitmap at a time
+    dbits = img.dbitmap.cast('B')
+    for base in range(0, len(seen), 8192):
+        marked = dbits[base:base + 8192]
+        reached = seen[base:base + 8192]
+        if marked == reached:
+            continue
+        for off in range(len(reached)):
+            leaked = marked[off] & ~reached[off]
+            while leaked:
+                low = leaked & -leaked
+                dblock = (base + off) * 8 + low.bit_length() - 1
+                if dblock < numData:
+                    error(f'block {dblock} is marked in the data bitmap but not used')
+                leaked ^= low
+
+    freeInodes = numInodes - usedInodes
+    if freeInodes != img.ifree:
+        error(f'superblock says {img.ifree} free inodes, there are {freeInodes}')
+    usedData = sum(bin(b).count('1') for b in seen)
+    if numData - usedData != img.dfree:
+        error(f'superblock says {img.dfree} free data blocks, there are {numData - usedData}')
+
+    print(f'fsck: {numInodes} inodes ({usedInodes} used), {numData} data blocks ({usedData} used), '
+          f'{len(errors)} problem(s)')
+    return len(errors)
+
+# --- Metadata journal ---
+#
+# Journal of an image IMG, kept in IMG.journal. Each transaction group is
+# one write of BLOCK_SIZE blocks:
+#   descriptor  JOURNAL_DESC (magic, sequence, block count), then the image
+#               block numbers as int64
+#   images      one block per number, as it is to be written in place
+#   commit      JOURNAL_COMMIT (magic, sequence, crc32 of the above)
+# A group only counts once its commit block is there and the checksum
+# matches, so a crash while writing it loses the group, never half of it.
+
+JOURNAL_DESC   = struct.Struct('<8sQI')
+JOURNAL_COMMIT = struct.Struct('<8sQI')
+JOURNAL_MAGIC  = b'VSFSJNL\0'
+COMMIT_MAGIC   = b'VSFSCMT\0'
+JOURNAL_MAX    = 4 << 20   # checkpoint once the journal is this long
+
+def journalPath(imagePath):
+    return imagePath + '.journal'
+
+def replayJournal(imagePath):
+    # Redoes every committed group of the image's journal in place, then
+    # empties the journal. Returns the number of groups replayed.
+    path = journalPath(imagePath)
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return 0
+    with open(path, 'rb') as f:
+        log = f.read()
+    groups = []
+    pos = 0
+    seq = None
+    while pos + BLOCK_SIZE <= len(log):
+        magic, gseq, count = JOURNAL_DESC.unpack_from(log, pos)
+        if magic != JOURNAL_MAGIC or (seq is not None and gseq != seq + 1):
+            break
+        descLen = -(-(JOURNAL_DESC.size + 8 * count) // BLOCK_SIZE) * BLOCK_SIZE
+        end = pos + descLen + (count + 1) * BLOCK_SIZE
+        if end > len(log):
+            break
+        magic, cseq, crc = JOURNAL_COMMIT.unpack_from(log, end - BLOCK_SIZE)
+        if magic != COMMIT_MAGIC or cseq != gseq or crc != zlib.crc32(log[pos:end - BLOCK_SIZE]):
+            break
+        blocks = struct.unpack_from(f'<{count}q', log, pos + JOURNAL_DESC.size)
+        groups.append((blocks, pos + descLen))
+        pos = end
+        seq = gseq
+    with open(imagePath, 'r+b') as img:
+        for blocks, start in groups:
+            for i, blk in enumerate(blocks):
+                img.seek(blk * BLOCK_SIZE)
+                img.write(log[start + i * BLOCK_SIZE:start + (i + 1) * BLOCK_SIZE])
+        img.flush()
+        os.fsync(img.fileno())
+    # only now may the journal go: a crash before this replays it again
+    with open(path, 'r+b') as f:
+        f.truncate(0)
+    return len(groups)
+
+class metaJournal(blockDevice):
+    # Write-ahead redo journal of the metadata of an fs opened from an image.
+    # Every op is a transaction: the image blocks it writes (bitmaps, inode
+    # fields, directory blocks, and file blocks, whose headers hold the
+    # block chains) are collected through the same hooks as the buffer
+    # cache, which it passes accesses on to. Every group transactions are
+    # committed together: one journal write of the blocks as they are in
+    # memory then, and one fsync. Committed blocks are written in place
+    # (checkpointed) when the journal reaches maxBytes and at close.
+    def __init__(self, fs, group=1, cache=None, maxBytes=None):
+        assert(fs.image is not None and group > 0)
+        super().__init__(fs.numInodes, fs.numData)
+        self.fs = fs
+        self.group = group
+        self.cache = cache
+        self.maxBytes = maxBytes if maxBytes is not None else JOURNAL_MAX
+        self.f = open(journalPath(fs.image.path), 'ab')
+        self.seq = 0
+        self.txn = {}       # running transaction: block -> owner (see fs.blockImage)
+        self.open = {}      # finished transactions not committed yet
+        self.openCount = 0
+        self.pending = {}   # committed, not yet checkpointed
+        self.txns = 0
+        self.commits = 0
+        self.journalBytes = 0
+        self.checkpointBytes = 0
+        self.inPlaceBytes = 0  # what writing each transaction in place would cost
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    def access(self, blk, write, whole=False):
+        if write and blk not in self.txn:
+            self.txn[blk] = None
+        if self.cache is not None:
+            self.cache.access(blk, write, whole)
+
+    def bits(self, region, first, last, write=False):
+        if write:
+            self.txn[0] = None  # the superblock's free counts
+        super().bits(region, first, last, write)
+
+    def data(self, num, write=False, whole=False, owner=None):
+        if write:
+            self.txn[self.dataBase + num] = owner
+        super().data(num, write, whole, owner)
+
+    def end(self):
+        # the running op is done; commits if that completes a group
+        if not self.txn:
+            return
+        self.txns += 1
+        self.inPlaceBytes += len(self.txn) * BLOCK_SIZE
+        self.open.update(self.txn)
+        self.txn = {}
+        self.openCount += 1
+        if self.openCount >= self.group:
+            self.commit()
+
+    def pack(self):
+        # the open group as it goes to the journal: (descriptor + blocks, commit record)
+        blocks = sorted(self.open)
+        desc = JOURNAL_DESC.pack(JOURNAL_MAGIC, self.seq, len(blocks)) + struct.pack(f'<{len(blocks)}q', *blocks)
+        body = b''.join([desc, bytes(-len(desc) % BLOCK_SIZE)] +
+                        [self.fs.blockImage(blk, self.open[blk]) for blk in blocks])
+        commit = JOURNAL_COMMIT.pack(COMMIT_MAGIC, self.seq, zlib.crc32(body)).ljust(BLOCK_SIZE, b'\0')
+        return body, commit
+
+    def commit(self):
+        if not self.open:
+            return
+        body, commit = self.pack()
+        self.f.write(body + commit)
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.journalBytes += len(body) + len(commit)
+        self.seq += 1
+        self.commits += 1
+        self.pending.update(self.open)
+        self.open = {}
+        self.openCount = 0
+        if self.f.tell() >= self.maxBytes:
+            self.checkpoint()
+
+    def checkpoint(self):
+        # only called right after a commit, so memory holds the committed state
+        with open(self.fs.image.path, 'r+b') as img:
+            for blk in sorted(self.pending):
+                img.seek(blk * BLOCK_SIZE)
+                img.write(self.fs.blockImage(blk, self.pending[blk]))
+            img.flush()
+            os.fsync(img.fileno())
+        self.checkpointBytes += len(self.pending) * BLOCK_SIZE
+        self.pending = {}
+        self.f.truncate(0)
+        self.f.seek(0)
+
+    def close(self):
+        self.commit()
+        self.checkpoint()
+        self.f.close()
+        self.elapsed = time.perf_counter() - self.started
+
+    def crash(self, tear=False):
+        # stop as if the machine went down: the open group is lost and
+        # nothing more reaches the image. tear: it went down while
+        # committing the open group, after its blocks and half of its commit
+        # record were written. Returns whether there was a group to tear.
+        torn = tear and bool(self.open)
+        if torn:
+            body, commit = self.pack()
+            self.f.write(body + commit[:JOURNAL_COMMIT.size // 2])
+        self.f.close()
+        self.elapsed = time.perf_counter() - self.started
+        return torn
+
+    def stats(self):
+        written = self.journalBytes + self.checkpointBytes
+        return {
+            'transactions': self.txns,
+            'commits': self.commits,
+            'commits/sec': self.commits / self.elapsed if self.elapsed > 0 else 0.0,
+            'journal bytes': self.journalBytes,
+            'checkpoint bytes': self.checkpointBytes,
+            # bytes written (journal + in place) per byte of metadata the
+            # transactions changed
+            'write amplification': written / self.inPlaceBytes if self.inPlaceBytes else 0.0,
+        }
 
 # --- Main ---
 
@@ -423,185 +1967,112 @@ parser = OptionParser()
 parser.add_option("-s", "--seed", dest="seed", help="random seed", default=0, type="int")
 parser.add_option("-i", "--numInodes", dest="numInodes", help="number of inodes in file system", default=8, type="int")
 parser.add_option("-d", "--numData", dest="numData", help="number of data blocks in file system", default=8, type="int")
-parser.add_option("-n", "--numRequests", dest="numRequests", help="number of requests to simulate", default=10, type="int")
+parser.add_option("-n", "--numRequests", dest="numRequests", help="number of requests to simulate (default 10; with --replay, the whole log)", default=None, type="int")
 parser.add_option("-r", "--reverse", dest="reverse", help="instead of printing state, print ops", default=False, action="store_true")
+parser.add_option("-a", "--alloc", dest="alloc", help="allocation policy for both bitmaps: first, next, random or best", default="first", type="choice", choices=list(bitmap.POLICIES))
+parser.add_option("-N", "--nested", dest="nested", help="create files and directories in random existing directories, not just the root", default=False, action="store_true")
+parser.add_option("-D", "--dcache", dest="dcache", help="dentry cache size in entries (0: off)", default=1024, type="int")
+parser.add_option("-A", "--append", dest="append", help="writes append a block to the file instead of rewriting its only block", default=False, action="store_true")
+parser.add_option("-L", "--layout", dest="layout", help="print per-file extent counts and free-space fragmentation at the end", default=False, action="store_true")
+parser.add_option("--open", dest="open", help="start from this image (made with --save) instead of an empty file system", default="", type="string")
+parser.add_option("--save", dest="save", help="write the final file system as an image to this file", default="", type="string")
+parser.add_option("--fsck", dest="fsck", help="check this image for consistency and exit", default="", type="string")
+parser.add_option("-q", "--quiet", dest="quiet", help="no per-op output; report ops/sec and per-op counts", default=False, action="store_true")
+parser.add_option("--delta", dest="delta", help="after the initial state, print only the bitmap, inode and block entries each op changed", default=False, action="store_true")
+parser.add_option("--record", dest="record", help="write the ops run to this op log", default="", type="string")
+parser.add_option("--replay", dest="replay", help="run the ops in this op log instead of random ones", default="", type="string")
+parser.add_option("-B", "--bcache", dest="bcache", help="count block I/O through a buffer cache of this many blocks (0: off)", default=0, type="int")
+parser.add_option("--bcachePolicy", dest="bcachePolicy", help="buffer cache replacement: lru or clock", default="lru", type="choice", choices=list(bufferCache.POLICIES))
+parser.add_option("--writeThrough", dest="writeThrough", help="buffer cache writes go to disk at once instead of on eviction", default=False, action="store_true")
+parser.add_option("-J", "--journal", dest="journal", help="run on this image (made with -i/-d if missing) with a metadata journal in IMAGE.journal; an existing journal is replayed first", default="", type="string")
+parser.add_option("-G", "--group", dest="group", help="transactions per journal commit; several (comma-separated) rerun the same ops once per size and compare", default="1", type="string")
+parser.add_option("--crash", dest="crash", help="with -J: crash after this op (the open group is lost, no checkpoint), then replay the journal and fsck the image", default=None, type="int")
+parser.add_option("--tear", dest="tear", help="with --crash: crash while committing the open group, leaving a torn commit record", default=False, action="store_true")
 parser.add_option("-c", "--compute", dest="compute", help="compute answers for me", default=False, action="store_true")
 
 (options, args) = parser.parse_args()
 
-random.seed(options.seed)
-
-s = fs(options.numInodes, options.numData)
-
-# Reverse mode: we print operations, user guesses state
-if options.reverse:
-    # We need to buffer output because we want to print operation FIRST,
-    # then wait for user (or just print blank lines), then print state if -c is on.
-    
-    # Actually, the problem logic is: 
-    # Print Op
-    # If -c: Print State
-    # Else: Print nothing (user fills in)
-    pass
-
-# Standard mode: print state, user guesses op
-# BUT the logic inside s.run() prints op THEN state immediately.
-# Let's adjust s.run logic or just run it?
-# The standard vsfs.py from OSTEP just runs and prints everything if not controlled differently.
-# However, for the homework, usually it hides something.
-
-# Let's override the run loop here to match the specific "quiz" style if needed, 
-# but the standard tool usually just dumps everything and you use your eyes to hide parts,
-# OR it has specific logic.
-# Looking at the standard vsfs.py, it prints everything.
-# The user's job is to look at State 0 -> State 1 and deduce the op (Standard)
-# OR look at Op -> deduce State (Reverse).
-
-# Let's modify the run loop slightly to handle -r and -c properly as per OSTEP description.
-# In the original vsfs.py, the logic is embedded.
-
-# Re-implementing a cleaner run loop for the "Quiz" mode:
-
-if options.reverse:
-    # Show OP, hide STATE (unless -c)
-    print("Initial state")
-    s.dump()
-    print("")
-    
-    for i in range(options.numRequests):
-        # Pick op
-        if len(s.files) > 0:
-            op = random.random()
-        else:
-            op = 0.0 # force create
-
-        op_desc = ""
-        success = False
-        
-        if op < 0.5: # create
-            f = s.makeName()
-            if random.random() < 0.5:
-                op_desc = f'mkdir("/{f}");'
-                if s.createFile(0, f, 'd') != -1:
-                    s.files.append(f)
-                    success = True
-                else:
-                    op_desc += " [failed]"
-            else:
-                op_desc = f'creat("/{f}");'
-                if s.createFile(0, f, 'f') != -1:
-                    s.files.append(f)
-                    success = True
-                else:
-                    op_desc += " [failed]"
-        elif op < 0.7: # write
-            if len(s.files) > 0:
-                f = random.choice(s.files)
-                op_desc = f'fd=open("/{f}", O_WRONLY|O_APPEND); write(fd, buf, BLOCKSIZE); close(fd);'
-                if s.writeFile(f, "a") != -1:
-                    success = True
-                else:
-                    op_desc += " [failed]"
-        elif op < 0.8: # delete
-            if len(s.files) > 0:
-                f = random.choice(s.files)
-                op_desc = f'unlink("/{f}");'
-                if s.deleteFile(f) != -1:
-                    s.files.remove(f)
-                    success = True
-                else:
-                    op_desc += " [failed]"
-        else: # link
-            if len(s.files) > 0:
-                target = random.choice(s.files)
-                newfile = s.makeName()
-                op_desc = f'link("/{target}", "/{newfile}");'
-                if s.createLink(target, newfile, 0) != -1:
-                    s.files.append(newfile)
-                    success = True
-                else:
-                    op_desc += " [failed]"
-
-        # Print Op
-        print(op_desc)
-        
-        # If compute, print result state
-        if options.compute:
-            s.dump()
-        else:
-            print("  State? (Use -c to see the answer)")
-        print("")
+if options.fsck:
+    sys.exit(1 if fsck(options.fsck) else 0)
 
+image = options.journal or options.open or None
+if options.journal and not os.path.exists(options.journal):
+    # mkfs
+    fs(options.numInodes, options.numData).save(options.journal)
+groups = [int(g) for g in options.group.split(',')]
+if options.replay:
+    numRequests = options.numRequests
 else:
-    # Standard Mode: Show STATE, hide OP (unless -c)
-    # Actually standard mode usually prints everything.
-    # But usually for the homework "guess the op", it prints the states and hides the op?
-    # No, typically vsfs.py prints everything and you just cover one part.
-    # BUT, to match the behavior of OSTEP scripts:
-    # If -c is NOT supplied, it might hide the op?
-    # Actually, in standard OSTEP scripts, usually it prints the "Job" and you have to guess.
-    # Here:
-    # Standard: Prints "State 0", "State 1"... User guesses what happened between.
-    
-    # Let's simulate that:
-    print("Initial state")
-    s.dump()
-    print("")
-
-    for i in range(options.numRequests):
-        # We need to perform the op silently first, then print the transition
-        old_ibitmap = s.ibitmap.dump()
-        # deep copy is hard here, but we just need to track the op string
-        
-        if len(s.files) > 0:
-            op = random.random()
-        else:
-            op = 0.0
-
-        op_desc = ""
-        
-        if op < 0.5: # create
-            f = s.makeName()
-            if random.random() < 0.5:
-                op_str = f'mkdir("/{f}");'
-                if s.createFile(0, f, 'd') != -1:
-                    s.files.append(f)
-                else:
-                    op_str += " [failed]"
-            else:
-                op_str = f'creat("/{f}");'
-                if s.createFile(0, f, 'f') != -1:
-                    s.files.append(f)
-                else:
-                    op_str += " [failed]"
-        elif op < 0.7: # write
-            if len(s.files) > 0:
-                f = random.choice(s.files)
-                op_str = f'fd=open("/{f}", O_WRONLY|O_APPEND); write(fd, buf, BLOCKSIZE); close(fd);'
-                if s.writeFile(f, "a") == -1:
-                    op_str += " [failed]"
-        elif op < 0.8: # delete
-            if len(s.files) > 0:
-                f = random.choice(s.files)
-                op_str = f'unlink("/{f}");'
-                if s.deleteFile(f) != -1:
-                    s.files.remove(f)
-                else:
-                     op_str += " [failed]"
-        else: # link
-            if len(s.files) > 0:
-                target = random.choice(s.files)
-                newfile = s.makeName()
-                op_str = f'link("/{target}", "/{newfile}");'
-                if s.createLink(target, newfile, 0) != -1:
-                    s.files.append(newfile)
-                else:
-                    op_str += " [failed]"
+    numRequests = 10 if options.numRequests is None else options.numRequests
+if options.crash is not None:
+    assert options.journal and len(groups) == 1, "--crash needs -J and one -G size"
+    if options.numRequests is None:
+        numRequests = options.crash
+    else:
+        numRequests = min(options.numRequests, options.crash)
+
+if options.journal and len(groups) > 1:
+    # The same ops once per group size, each on a scratch copy of the image
+    replayJournal(options.journal)
+    print(f'{"group":>6} {"ops/sec":>10} {"commits":>9} {"commits/sec":>12} {"journal bytes":>14} '
+          f'{"checkpoint bytes":>17} {"write amp":>10}')
+    with tempfile.TemporaryDirectory() as tmp:
+        for group in groups:
+            scratch = os.path.join(tmp, f'image{group}')
+            shutil.copyfile(options.journal, scratch)
+            random.seed(options.seed)
+            t = fs(0, 0, options.alloc, options.seed, options.nested, options.dcache, options.append, scratch)
+            t.scanNames()
+            if options.bcache > 0:
+                t.useBufferCache(options.bcache, options.bcachePolicy, not options.writeThrough)
+            t.useJournal(group)
+            counts = t.run(numRequests, 'silent', ops=readOpLog(options.replay) if options.replay else None)
+            t.journal.close()
+            st = t.journal.stats()
+            ops = sum(done for done, _ in counts.values())
+            print(f'{group:6} {ops / t.journal.elapsed:10.0f} {st["commits"]:9} {st["commits/sec"]:12.0f} '
+                  f'{st["journal bytes"]:14} {st["checkpoint bytes"]:17} {st["write amplification"]:10.2f}')
+    sys.exit(0)
 
-        if options.compute:
-            print(op_str)
-        else:
-            print("Which operation took place?")
-        
-        s.dump()
-        print("")
+random.seed(options.seed)
+
+s = fs(options.numInodes, options.numData, options.alloc, options.seed, options.nested, options.dcache, options.append,
+       image)
+if image is not None:
+    if s.replayed:
+        print(f'journal: replayed {s.replayed} committed groups')
+    s.scanNames()
+if options.bcache > 0:
+    s.useBufferCache(options.bcache, options.bcachePolicy, not options.writeThrough)
+if options.journal:
+    s.useJournal(groups[0])
+
+# Default: print the states, the user works out each op (-c shows it).
+# -r: print the ops, the user works out each state (-c shows it).
+# -q: no per-op output, just throughput and op counts.
+if options.quiet:
+    mode = 'quiet'
+elif options.reverse:
+    mode = 'ops'
+else:
+    mode = 'state'
+counts = s.run(numRequests, mode, options.compute, options.delta,
+               readOpLog(options.replay) if options.replay else None, options.record)
+
+print(f'dentry cache: {s.dcache.hits} hits, {s.dcache.misses} misses')
+if options.layout:
+    s.printLayout()
+if options.journal:
+    if options.crash is not None:
+        torn = s.journal.crash(options.tear)
+        s.printJournal()
+        done = sum(ops for ops, _ in counts.values())
+        print(f'crash after op {done}' + (', commit record torn' if torn else '') +
+              f' ({s.journal.openCount} uncommitted transactions lost)')
+        # recover as the next open of the image would, then check it
+        print(f'journal: replayed {replayJournal(options.journal)} committed groups')
+        sys.exit(1 if fsck(options.journal) else 0)
+    s.journal.close()
+    s.printJournal()
+if options.save:
+    s.save(options.save)